@@ -18,3 +18,5 @@ LOG_LEVELS = {
 API_KEY = os.getenv("PIPELINES_API_KEY", "0p3n-w3bu!")
 PIPELINES_DIR = os.getenv("PIPELINES_DIR", "./pipelines")
 VALVES_DIR = os.getenv("VALVES_DIR", "./valves")
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "40"))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
@@ -4,7 +4,7 @@ author: Demo
 version: 0.2.0
 license: MIT
 description: Translates PDF documents to Arabic while preserving layout
-requirements: arabic-reshaper, pymupdf, python-bidi
+requirements: arabic-reshaper, numpy, orjson, pymupdf, python-bidi>=0.5
 """
 
 from .pipeline import Pipeline  # noqa: F401
@@ -0,0 +1,56 @@
+"""pdf2pdf - persistent translation cache."""
+
+import hashlib
+import sqlite3
+import threading
+
+
+class TranslationCache:
+    """
+    SQLite-backed map from (model, system prompt, source text) to translation.
+
+    Keys are SHA1 digests, so the same paragraph translated under the same
+    model and prompt is reused across documents and restarts. One connection
+    is shared by the translation worker threads behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def key(model, system_prompt, text):
+        """Return the cache key for *text* translated by *model*."""
+        return hashlib.sha1(
+            f"{model}|{system_prompt}|{text}".encode()
+        ).hexdigest()
+
+    def get_many(self, keys):
+        """Return ``{key: translation}`` for the cached subset of *keys*."""
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM translations WHERE key IN ({placeholders})",
+                list(keys),
+            ).fetchall()
+        return dict(rows)
+
+    def put_many(self, items):
+        """Store ``(key, translation)`` pairs in a single transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations (key, value) VALUES (?, ?)",
+                items,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
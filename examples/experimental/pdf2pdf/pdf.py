@@ -1,8 +1,22 @@
 """pdf2pdf - PDF text extraction and Arabic rebuild helpers."""
 
+import logging
+import math
+import multiprocessing
+import os
+import site
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import repeat
+
 import arabic_reshaper
 import fitz  # PyMuPDF
-from bidi.algorithm import get_display
+import numpy as np
+from bidi import get_display
+
+log = logging.getLogger(__name__)
 
 # ============================================================
 # DEFAULT SYSTEM PROMPT
@@ -33,11 +47,29 @@ OUTPUT: Provide ONLY the Arabic translation. No explanations, no notes, no Engli
 # PDF TEXT EXTRACTION
 # ============================================================
 
+# Default "dict" flags minus image blocks (we skip them, but PyMuPDF would
+# still build them with the full image bytes) and ligature preservation
+# (expanded ligatures are what the translator should see anyway).
+EXTRACT_FLAGS = (
+    fitz.TEXTFLAGS_DICT
+    & ~fitz.TEXT_PRESERVE_IMAGES
+    & ~fitz.TEXT_PRESERVE_LIGATURES
+)
+
 
 def extract_pdf(filepath):
     """
     Extract text from PDF with layout metadata using PyMuPDF.
     Returns (texts, layout_data).
+
+    Each page's ``lines`` is a dict of parallel per-line columns, with the
+    format taken from the line's first non-empty span:
+
+    - ``text_indices``: (N,) int32 index into *texts*
+    - ``bboxes``: (N, 4) float32 ``x0, y0, x1, y1``
+    - ``sizes``: (N,) float32 font size
+    - ``colors``: (N,) uint32 sRGB ``0xRRGGBB``
+    - ``fonts``, ``texts``: lists of font names and original line texts
     """
     doc = fitz.open(filepath)
     texts = []
@@ -49,36 +81,42 @@ def extract_pdf(filepath):
 
     for page_num in range(len(doc)):
         page = doc[page_num]
-        page_data = {"page_num": page_num, "lines": []}
-        blocks = page.get_text("dict")["blocks"]
+        first_index = len(texts)
+        bboxes, sizes, fonts, colors = [], [], [], []
+        blocks = page.get_text("dict", flags=EXTRACT_FLAGS)["blocks"]
 
         for block in blocks:
             if block["type"] != 0:
                 continue
             for line in block["lines"]:
-                parts = []
+                buf = []
                 first_span = None
                 for span in line["spans"]:
-                    if span["text"].strip():
-                        parts.append(span["text"])
+                    text = span["text"]
+                    if text.strip():
                         if first_span is None:
-                            first_span = {
-                                "size": span["size"],
-                                "font": span["font"],
-                                "color": span["color"],
-                            }
-                if not parts:
+                            first_span = span
+                        buf.append(text)
+                if not buf:
                     continue
-                line_text = " ".join(parts)
-                page_data["lines"].append({
-                    "text_index": len(texts),
-                    "original_text": line_text,
-                    "bbox": list(line["bbox"]),
-                    "span_format": first_span,
-                })
-                texts.append(line_text)
-
-        layout_data["pages"].append(page_data)
+                bboxes.append(line["bbox"])
+                sizes.append(first_span["size"])
+                fonts.append(first_span["font"])
+                colors.append(first_span["color"])
+                texts.append(" ".join(buf) if len(buf) > 1 else buf[0])
+
+        n = len(texts) - first_index
+        layout_data["pages"].append({
+            "page_num": page_num,
+            "lines": {
+                "text_indices": np.arange(first_index, len(texts), dtype=np.int32),
+                "bboxes": np.array(bboxes, dtype=np.float32).reshape(n, 4),
+                "sizes": np.fromiter(sizes, dtype=np.float32, count=n),
+                "colors": np.fromiter(colors, dtype=np.uint32, count=n),
+                "fonts": fonts,
+                "texts": texts[first_index:],
+            },
+        })
 
     doc.close()
     return texts, layout_data
@@ -88,122 +126,304 @@ def extract_pdf(filepath):
 # PDF REBUILD (PDF -> PDF)
 # ============================================================
 
+# Background sampling: a page whose pixels on this grid (in 1x pixels) vary
+# by less than UNIFORM_MAX_STD per channel gets a single fill color.
+UNIFORM_GRID_STEP = 32
+UNIFORM_MAX_STD = 3.0
 
+
+# Module-level reshaper with the configuration spelled out, so shaping does
+# not silently change with library defaults. Harakat are dropped as before:
+# insert_textbox does not position combining marks.
+_reshaper = arabic_reshaper.ArabicReshaper(
+    configuration={"delete_harakat": True, "support_ligatures": True}
+)
+
+
+@lru_cache(maxsize=8192)
 def shape_arabic(text):
-    """Reshape Arabic glyphs and apply bidi reordering for PDF rendering."""
-    reshaped = arabic_reshaper.reshape(text)
+    """
+    Reshape Arabic glyphs and apply bidi reordering for PDF rendering.
+
+    Memoized: headers, footers and table labels repeat across pages.
+    """
+    reshaped = _reshaper.reshape(text)
     return get_display(reshaped)
 
 
-def rebuild_pdf(input_path, translations, layout_data, output_path, font_path):
+def _plan_page(input_path, page_data, page_width):
+    """
+    Plan the redactions and text inserts for one page.
+
+    Runs in a worker process: opens its own read-only handle on the input
+    PDF so page rendering and pixel sampling happen outside the parent's
+    MuPDF lock. Needs no translations, so it can run while they are still
+    being fetched. Returns ``(redactions, inserts)`` as plain tuples:
+    ``(bbox, fill_rgb)`` and ``(line, insert_rect, color_rgb, font_size)``,
+    where *line* is the line's position on the page.
+    """
+    lines = page_data["lines"]
+    n = len(lines["text_indices"])
+    if not n:
+        # Nothing to redact or insert: skip rendering the page at all
+        return [], []
+
+    # float64 from here on so the geometry matches the PDF coordinates
+    x0, y0, x1, y1 = lines["bboxes"].astype(np.float64).T
+
+    doc = fitz.open(input_path)
+    page = doc[page_data["page_num"]]
+
+    # Render page once at 1x and view the samples as an (H, W, 3) array
+    pix = page.get_pixmap(alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+        pix.height, pix.width, pix.n
+    )
+
+    grid = arr[::UNIFORM_GRID_STEP, ::UNIFORM_GRID_STEP, :3].reshape(-1, 3)
+    if grid.std(axis=0).max() < UNIFORM_MAX_STD:
+        # Near-uniform page: one background color serves every line
+        bg = np.median(grid, axis=0) * (1.0 / 255.0)
+        colors = np.broadcast_to(bg, (n, 3))
+    else:
+        # Gather every line's sample point (just left of the text,
+        # vertically centred) and read all colors in one indexing op
+        xs = np.clip(x0.astype(np.intp) - 5, 0, pix.width - 1)
+        ys = np.clip(((y0 + y1) / 2).astype(np.intp), 0, pix.height - 1)
+        colors = arr[ys, xs, :3] * (1.0 / 255.0)
+
+    # colors is a copy; drop the page raster now so a worker holds at most
+    # one pixmap at a time however many pages it plans
+    del arr, grid, pix
+    doc.close()
+
+    # Unpack all sRGB text colors (0xRRGGBB ints) at once
+    packed = lines["colors"]
+    text_colors = np.stack(
+        [(packed >> 16) & 0xFF, (packed >> 8) & 0xFF, packed & 0xFF], axis=1
+    ) * (1.0 / 255.0)
+
+    # Cover boxes: the line bbox padded a little on every side
+    covers = np.stack([x0 - 4, y0 - 2, x1 + 4, y1 + 2], axis=1)
+
+    # RTL layout: mirror the original left margin to the right,
+    # extend the box leftward for Arabic text width
+    sizes = lines["sizes"].astype(np.float64)
+    right_edge = page_width - x0  # mirror left margin
+    width = np.maximum((x1 - x0) * 2.0, right_edge)
+    height = np.maximum((y1 - y0) * 2.0, sizes * 3.0)
+    boxes = np.stack(
+        [np.maximum(0, right_edge - width), y0, right_edge, y0 + height], axis=1
+    )
+
+    redactions = [
+        (tuple(cover), tuple(bg))
+        for cover, bg in zip(covers.tolist(), colors.tolist())
+    ]
+    inserts = [
+        (line, tuple(box), tuple(fg), size)
+        for line, (box, fg, size) in enumerate(
+            zip(boxes.tolist(), text_colors.tolist(), sizes.tolist())
+        )
+    ]
+
+    return redactions, inserts
+
+
+def _insert_fitted(page, rect, text, font, font_name, font_size, color):
+    """
+    Insert *text* into *rect*, shrinking the font size until it fits.
+
+    The size is first estimated from the measured text length against the
+    box area, so most lines go in with a single ``insert_textbox`` call.
+    If the estimate still overflows, two bisection steps towards half that
+    size are tried before giving up.
+    """
+    if font_size <= 0:
+        # Nothing to scale from, and a zero size would insert invisible text
+        log.warning(
+            f"Skipping text with font size {font_size} on page {page.number}: {text!r}"
+        )
+        return
+
+    line_height = font_size * (font.ascender - font.descender)
+    if line_height > 0:
+        capacity = rect.width * rect.height / line_height
+        text_length = font.text_length(text, fontsize=font_size)
+        if text_length > capacity:
+            font_size *= math.sqrt(capacity / text_length)
+
+    lo, hi = font_size * 0.5, font_size
+    for size in (hi, (lo + hi) / 2, lo + (hi - lo) / 4):
+        rc = page.insert_textbox(
+            rect,
+            text,
+            fontname=font_name,
+            fontsize=size,
+            color=color,
+            align=fitz.TEXT_ALIGN_RIGHT,
+        )
+        if rc >= 0:
+            return
+    log.warning(f"Text does not fit its box on page {page.number}: {text!r}")
+
+
+# Shorter documents are planned inline: starting work in the pool costs
+# more than it saves on a few pages
+PARALLEL_MIN_PAGES = 5
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _import_root():
+    """Return the directory from which this module imports under its name.
+
+    Spawned workers unpickle :func:`_plan_page` by module name, which only
+    resolves once this directory is on their ``sys.path`` (the server loads
+    pipeline packages from ``PIPELINES_DIR`` without adding it there).
+    """
+    root = os.path.abspath(__file__)
+    for _ in __name__.split("."):
+        root = os.path.dirname(root)
+    return root
+
+
+def _get_pool():
+    """Return the page-planning process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not the fork default: plan_pdf runs on a thread of the
+            # multithreaded server, and a forked child can inherit a MuPDF
+            # or logging lock held by another thread and deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=site.addsitedir,
+                initargs=(_import_root(),),
+            )
+        return _pool
+
+
+def shutdown_pool():
+    """Stop the page-planning workers (call from the pipeline's shutdown)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _discard_pool(pool):
+    """Drop a broken *pool* so the next :func:`_get_pool` starts a new one."""
+    global _pool
+    with _pool_lock:
+        # Another thread may already have replaced it
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def plan_pdf(input_path, layout_data, parallel=True):
     """
-    Rebuild PDF with translated Arabic text using redact-and-overlay.
+    Plan every page of *input_path* (render, sample bg colors, lay out text
+    boxes) and return the per-page plans for :func:`rebuild_pdf`.
+
+    Pages are independent, so documents of :data:`PARALLEL_MIN_PAGES` or
+    more pages are planned in a shared process pool; pass
+    ``parallel=False`` to always plan inline.  If a worker dies, the broken
+    pool is dropped and the document is planned inline instead.
+    """
+    pages = layout_data["pages"]
+    plan_args = (repeat(input_path), pages, repeat(layout_data["pdf_width"]))
+    if parallel and len(pages) >= PARALLEL_MIN_PAGES:
+        pool = _get_pool()
+        try:
+            return list(pool.map(_plan_page, *plan_args))
+        except BrokenProcessPool as e:
+            log.warning(f"Page planning pool broke, planning inline: {e}")
+            _discard_pool(pool)
+    return list(map(_plan_page, *plan_args))
+
+
+def rebuild_pdf(
+    input_path, translations, layout_data, output_path, font_path,
+    parallel=True, remove_original_text=False, plans=None,
+):
+    """
+    Rebuild PDF with translated Arabic text using cover-and-overlay.
 
     Strategy:
-    1. For each page, redact original text areas (fill with sampled bg color)
-    2. Insert translated Arabic text at the same positions
+    1. Plan each page (see :func:`plan_pdf`) unless *plans* were computed
+       ahead of time, e.g. while the translations were being fetched
+    2. For each page, cover original text areas with rectangles filled in
+       the sampled bg color
+    3. Insert translated Arabic text at the same positions
+
+    Covering leaves the original text in the content stream. Set
+    *remove_original_text* to redact it instead (slower: MuPDF rewrites
+    the page content stream).
+
+    Only the apply/save steps run serially in the calling process.
+    *parallel* is passed to :func:`plan_pdf`.
+
+    Writes to *output_path*, or returns the PDF bytes if it is None.
     """
+    pages = layout_data["pages"]
+    if plans is None:
+        plans = plan_pdf(input_path, layout_data, parallel)
+
     doc = fitz.open(input_path)
     font_name = "arabic"
 
-    # Register the Arabic font once
-    page0 = doc[0]
-    page0.insert_font(fontname=font_name, fontfile=font_path)
-
-    for page_data in layout_data["pages"]:
-        page_num = page_data["page_num"]
-        page = doc[page_num]
-
-        # Register font on this page
-        if page_num > 0:
-            page.insert_font(fontname=font_name, fontfile=font_path)
-
-        # Render page at 2x for background color sampling
-        sample_pix = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0))
-
-        # Step 1: Add redaction annotations over original text
-        for line_entry in page_data["lines"]:
-            bbox = line_entry["bbox"]
-            rect = fitz.Rect(bbox)
-
-            # Sample background color from just left of text
-            sx = max(0, int(rect.x0 * 2) - 10)
-            sy = int((rect.y0 + rect.height / 2) * 2)
-            sx = min(sx, sample_pix.width - 1)
-            sy = min(sy, sample_pix.height - 1)
-
-            try:
-                pixel = sample_pix.pixel(sx, sy)
-                bg_r = pixel[0] / 255.0
-                bg_g = pixel[1] / 255.0
-                bg_b = pixel[2] / 255.0
-            except Exception:
-                bg_r, bg_g, bg_b = 1.0, 1.0, 1.0
-
-            expanded = rect + (-4, -2, 4, 2)
-            page.add_redact_annot(expanded, fill=(bg_r, bg_g, bg_b))
-
-        page.apply_redactions()
-
-        # Step 2: Insert translated text
-        for line_entry in page_data["lines"]:
-            text_idx = line_entry["text_index"]
-            if text_idx < len(translations):
-                text = translations[text_idx]
+    # Parse the Arabic font once; each page references the same buffer,
+    # which PyMuPDF embeds a single time for the document
+    font = fitz.Font(fontfile=font_path)
+    font_buffer = font.buffer
+
+    n_translated = len(translations)
+    for page_data, (redactions, inserts) in zip(pages, plans):
+        if not redactions:
+            continue
+        page = doc[page_data["page_num"]]
+        text_indices = page_data["lines"]["text_indices"].tolist()
+        originals = page_data["lines"]["texts"]
+
+        if remove_original_text:
+            for bbox, fill in redactions:
+                page.add_redact_annot(fitz.Rect(bbox), fill=fill)
+            page.apply_redactions()
+        else:
+            # Paint over the original text; one shape keeps it to a single
+            # content-stream append instead of a full stream rewrite
+            shape = page.new_shape()
+            for bbox, fill in redactions:
+                shape.draw_rect(fitz.Rect(bbox))
+                shape.finish(color=fill, fill=fill, width=0)
+            shape.commit(overlay=True)
+
+        # Register after redacting: apply_redactions drops unused resources
+        page.insert_font(fontname=font_name, fontbuffer=font_buffer)
+
+        for line, insert_rect, color, font_size in inserts:
+            text_index = text_indices[line]
+            if text_index < n_translated:
+                text = translations[text_index]
             else:
-                text = line_entry.get("original_text", "")
-
+                text = originals[line]
             if not text.strip():
                 continue
 
-            text = shape_arabic(text)
-
-            bbox = line_entry["bbox"]
-            fmt = line_entry.get("span_format", {})
-            font_size = fmt.get("size", 12)
-
-            # Text color
-            color_int = fmt.get("color", 0)
-            r = ((color_int >> 16) & 0xFF) / 255.0
-            g = ((color_int >> 8) & 0xFF) / 255.0
-            b = (color_int & 0xFF) / 255.0
-
-            # RTL layout: mirror the original left margin to the right,
-            # extend the box leftward for Arabic text width
-            page_width = layout_data["pdf_width"]
-            orig_rect = fitz.Rect(bbox)
-            left_margin = orig_rect.x0
-            right_edge = page_width - left_margin  # mirror left margin
-            width = max(orig_rect.width * 2.0, right_edge)
-            height = max(orig_rect.height * 2.0, font_size * 3.0)
-            insert_rect = fitz.Rect(
-                max(0, right_edge - width),
-                orig_rect.y0,
-                right_edge,
-                orig_rect.y0 + height,
+            _insert_fitted(
+                page, fitz.Rect(insert_rect), shape_arabic(text),
+                font, font_name, font_size, color,
             )
 
-            rc = page.insert_textbox(
-                insert_rect,
-                text,
-                fontname=font_name,
-                fontfile=font_path,
-                fontsize=font_size,
-                color=(r, g, b),
-                align=fitz.TEXT_ALIGN_RIGHT,
-            )
-            if rc < 0:
-                # Text overflowed — retry with smaller font to fit the box
-                smaller = font_size * 0.7
-                page.insert_textbox(
-                    insert_rect,
-                    text,
-                    fontname=font_name,
-                    fontfile=font_path,
-                    fontsize=smaller,
-                    color=(r, g, b),
-                    align=fitz.TEXT_ALIGN_RIGHT,
-                )
+    if output_path is None:
+        pdf_bytes = doc.tobytes(garbage=4, deflate=True)
+        doc.close()
+        return pdf_bytes
 
     doc.save(output_path, garbage=4, deflate=True)
     doc.close()
@@ -3,10 +3,16 @@ from typing import Generator, Iterator, List, Optional, Union
 from pydantic import BaseModel, Field
 
 import logging
+import orjson
 import os
+import re
 import requests
+import sqlite3
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from requests.adapters import HTTPAdapter
 
+from config import VALVES_DIR
 from utils.pipelines.openwebui import (
     emit_status,
     get_api_context,
@@ -15,14 +21,47 @@ from utils.pipelines.openwebui import (
     upload_file,
 )
 
-from .pdf import DEFAULT_SYSTEM_PROMPT, extract_pdf, rebuild_pdf
+from .cache import TranslationCache
+from .pdf import (
+    DEFAULT_SYSTEM_PROMPT,
+    extract_pdf,
+    plan_pdf,
+    rebuild_pdf,
+    shape_arabic,
+    shutdown_pool,
+)
 
 log = logging.getLogger(__name__)
 
+# "12. text" / "12) text" / "12- text" / "12: text" -> ("12", "text")
+_NUMBERED = re.compile(r"^\s*(\d+)\s*[.):-]\s*(.*)$")
+
+
+def _new_session():
+    """Return a keep-alive session sized for concurrent translation batches."""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def needs_translation(text):
+    """Return False for numbers, single characters and punctuation-only text."""
+    stripped = text.strip()
+    return len(stripped) > 1 and any(c.isalpha() for c in stripped)
+
+
+def _request_translations(session, texts, base_url, headers, model, system_prompt):
+    """
+    Send one numbered batch to the model.
 
-def translate_batch(texts, base_url, headers, model, system_prompt):
-    """Translate a batch of texts via the Open WebUI model callback."""
-    numbered = "\n".join([f"{i + 1}. {t}" for i, t in enumerate(texts)])
+    Returns ``(translations, complete)`` as parsed by
+    :func:`_parse_translations`; on a failed request every text gets an
+    error placeholder and *complete* is False.
+    """
+    numbered = "\n".join(f"{i + 1}. {t}" for i, t in enumerate(texts))
     user_prompt = (
         "Translate each numbered item below to Arabic. "
         "Return ONLY the Arabic translations, keeping the same numbering. "
@@ -31,41 +70,107 @@ def translate_batch(texts, base_url, headers, model, system_prompt):
     )
 
     try:
-        r = requests.post(
+        r = session.post(
             f"{base_url}/api/chat/completions",
-            headers={**headers, "Content-Type": "application/json"},
-            json={
+            headers=headers,
+            data=orjson.dumps({
                 "model": model,
                 "messages": [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
                 ],
                 "stream": False,
-            },
+            }),
         )
         r.raise_for_status()
-        result = r.json()["choices"][0]["message"]["content"]
+        result = orjson.loads(r.content)["choices"][0]["message"]["content"]
     except Exception as e:
         log.error(f"Translation batch failed: {e}")
-        return [f"[Translation error: {e}]"] * len(texts)
-
-    translations = []
-    for line in result.strip().split("\n"):
-        line = line.strip()
-        if not line:
+        return [f"[Translation error: {e}]"] * len(texts), False
+
+    return _parse_translations(result, texts)
+
+
+def _parse_translations(result, texts):
+    """
+    Match the lines of a model reply to *texts*.
+
+    Lines are matched by their number, so a merged or split item can't shift
+    the rest.  A reply with no usable numbers but exactly one line per text
+    (e.g. a single unnumbered line for a 1-item batch) is paired by
+    position.  Texts left unanswered keep their original, with a warning.
+
+    Returns ``(translations, complete)``: *complete* is True only when the
+    reply numbered exactly 1..N, each once, with no stray lines, or was the
+    single line of a 1-item batch -- the only replies safe to cache.
+    """
+    lines = [line.strip() for line in result.splitlines() if line.strip()]
+
+    by_number = {}
+    complete = True
+    for line in lines:
+        m = _NUMBERED.match(line)
+        n = int(m.group(1)) if m else 0
+        if not 1 <= n <= len(texts) or n in by_number:
+            # Unnumbered (a split item), out of range or repeated
+            complete = False
             continue
-        if line[0].isdigit():
-            parts = line.split(".", 1)
-            translated = parts[1].strip() if len(parts) > 1 else line
-        else:
-            translated = line
-        translations.append(translated)
+        by_number[n] = m.group(2)
+
+    if not by_number and len(lines) == len(texts):
+        # Nothing numbered, but one line per text: the model dropped the
+        # numbering.  Only a single line can't have been merged or split
+        return lines, len(texts) == 1
+
+    translations = [by_number.get(i, t) for i, t in enumerate(texts, 1)]
+    missing = len(texts) - len(by_number)
+    if missing:
+        log.warning(
+            f"Translation reply left {missing} of {len(texts)} texts untranslated"
+        )
+    return translations, complete and not missing
+
 
-    while len(translations) < len(texts):
-        translations.append(texts[len(translations)])
-    translations = translations[: len(texts)]
+def translate_batch(
+    session, texts, base_url, headers, model, system_prompt, cache=None
+):
+    """
+    Translate a batch of texts via the Open WebUI model callback.
 
-    return translations
+    With a :class:`TranslationCache`, only cache misses are sent to the
+    model and successful translations are written back.
+    """
+    if cache is None:
+        return _request_translations(
+            session, texts, base_url, headers, model, system_prompt
+        )[0]
+
+    keys = [cache.key(model, system_prompt, t) for t in texts]
+    try:
+        found = cache.get_many(keys)
+    except sqlite3.Error as e:
+        # The cache is an optimization: translate the batch without it
+        log.warning(f"Translation cache read failed: {e}")
+        return _request_translations(
+            session, texts, base_url, headers, model, system_prompt
+        )[0]
+    misses = [(k, t) for k, t in zip(keys, texts) if k not in found]
+
+    if misses:
+        miss_texts = [t for _, t in misses]
+        translated, complete = _request_translations(
+            session, miss_texts, base_url, headers, model, system_prompt
+        )
+        fresh = dict(zip((k for k, _ in misses), translated))
+        # The cache never expires: only store replies that lined up exactly
+        if complete:
+            try:
+                cache.put_many(list(fresh.items()))
+            except sqlite3.Error as e:
+                log.warning(f"Translation cache write failed: {e}")
+        found.update(fresh)
+
+    return [found[k] for k in keys]
 
 
 class Pipeline:
@@ -84,14 +189,31 @@ class Pipeline:
             default="/app/fonts/arabic.ttf",
             description="Path to Arabic TrueType font file",
         )
+        concurrency: int = Field(
+            default=4,
+            description="Translation batches sent to the model in parallel",
+        )
+        remove_original_text: bool = Field(
+            default=False,
+            description=(
+                "Redact the original text instead of painting over it "
+                "(slower, but the source text is no longer extractable)"
+            ),
+        )
         system_prompt: str = Field(
             default=DEFAULT_SYSTEM_PROMPT,
             description="System prompt for the translation model",
         )
+        cache_enabled: bool = Field(
+            default=True,
+            description="Reuse translations across documents (SQLite cache)",
+        )
 
     def __init__(self):
         self.name = "PDF to PDF Translator"
         self.valves = self.Valves()
+        self._session = _new_session()
+        self._cache = None
 
     # -- Lifecycle -----------------------------------------------------------
 
@@ -100,9 +222,16 @@ class Pipeline:
 
     async def on_shutdown(self):
         log.info(f"on_shutdown: {self.name}")
+        self._session.close()
+        shutdown_pool()
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
 
     async def on_valves_updated(self):
         log.info(f"on_valves_updated: {self.valves}")
+        old, self._session = self._session, _new_session()
+        old.close()
 
     # -- Pipe ----------------------------------------------------------------
 
@@ -125,7 +254,7 @@ class Pipeline:
         # -- 1. Find PDF attachment via _files -------------------------------
         yield emit_status("Looking for PDF attachment")
 
-        pdfs = find_files_in_messages(messages, extension=".pdf")
+        pdfs = find_files_in_messages(messages, extension=".pdf", limit=1)
         if not pdfs:
             yield "No PDF file found. Please upload a PDF document to translate.\n"
             yield emit_status("No PDF found", done=True)
@@ -167,26 +296,62 @@ class Pipeline:
             yield emit_status("No text found", done=True)
             return
 
-        yield f"Extracted **{len(texts)}** text items.\n\n"
+        # Translate each distinct string once; numbers, single characters
+        # and punctuation-only lines pass through unchanged
+        unique_texts = [
+            t for t in dict.fromkeys(texts) if needs_translation(t)
+        ]
 
-        # -- 4. Translate in batches -----------------------------------------
-        translations = []
-        batch_size = self.valves.batch_size
-        total_batches = (len(texts) + batch_size - 1) // batch_size
-
-        for i in range(0, len(texts), batch_size):
-            batch_num = (i // batch_size) + 1
-            batch = texts[i : i + batch_size]
-            pct = int((batch_num / total_batches) * 100)
-            yield emit_status(
-                f"Translating batch {batch_num}/{total_batches} ({pct}%)"
-            )
+        yield (
+            f"Extracted **{len(texts)}** text items "
+            f"(**{len(unique_texts)}** to translate).\n\n"
+        )
 
-            translated = translate_batch(
-                batch, base_url, headers,
-                self.valves.model, self.valves.system_prompt,
-            )
-            translations.extend(translated)
+        # Page planning (render, bg sampling, layout) needs no translations:
+        # run it in the background while the batches are in flight
+        planner = ThreadPoolExecutor(max_workers=1)
+        plans_future = planner.submit(plan_pdf, input_path, layout_data)
+        planner.shutdown(wait=False)
+
+        # -- 4. Translate in batches ---------------------------------------
+        batch_size = self.valves.batch_size
+        batches = [
+            unique_texts[i : i + batch_size]
+            for i in range(0, len(unique_texts), batch_size)
+        ]
+        total_batches = len(batches)
+
+        yield emit_status(f"Translating {total_batches} batches")
+
+        cache = self._get_cache() if self.valves.cache_enabled else None
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, self.valves.concurrency)
+        ) as executor:
+            futures = [
+                executor.submit(
+                    translate_batch,
+                    self._session, batch, base_url, headers,
+                    self.valves.model, self.valves.system_prompt,
+                    cache=cache,
+                )
+                for batch in batches
+            ]
+            for done, future in enumerate(as_completed(futures), 1):
+                # Shape each batch as it lands so rebuild_pdf only hits
+                # the shape_arabic memo
+                for text in future.result():
+                    shape_arabic(text)
+                pct = int((done / total_batches) * 100)
+                yield emit_status(
+                    f"Translated batch {done}/{total_batches} ({pct}%)"
+                )
+
+        # Map results back by submission order, then fan out to every line
+        translated = {}
+        for batch, future in zip(batches, futures):
+            translated.update(zip(batch, future.result()))
+        translations = [translated.get(t, t) for t in texts]
 
         yield "Translation complete.\n\n"
 
@@ -195,6 +360,8 @@ class Pipeline:
 
         font_path = self.valves.font_path
         if not os.path.isfile(font_path):
+            plans_future.cancel()
+            wait([plans_future])
             os.unlink(input_path)
             yield (
                 f"Arabic font not found at `{font_path}`. "
@@ -203,15 +370,13 @@ class Pipeline:
             yield emit_status("Font not found", done=True)
             return
 
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_out:
-            output_path = tmp_out.name
-
         try:
-            rebuild_pdf(
-                input_path, translations, layout_data, output_path, font_path
+            pdf_result_bytes = rebuild_pdf(
+                input_path, translations, layout_data, None, font_path,
+                remove_original_text=self.valves.remove_original_text,
+                plans=plans_future.result(),
             )
         except Exception as e:
-            os.unlink(output_path)
             yield f"Failed to rebuild PDF: {e}\n"
             yield emit_status("Rebuild failed", done=True)
             return
@@ -225,10 +390,6 @@ class Pipeline:
         base_name = file_name.rsplit(".", 1)[0] if file_name else "translated"
         output_name = f"{base_name}_ar.pdf"
 
-        with open(output_path, "rb") as f:
-            pdf_result_bytes = f.read()
-        os.unlink(output_path)
-
         file_url = upload_file(
             base_url, headers, output_name, pdf_result_bytes,
             content_type="application/pdf",
@@ -239,3 +400,16 @@ class Pipeline:
             yield "Failed to upload translated PDF.\n"
 
         yield emit_status("Done", done=True)
+
+    # -- Helpers -------------------------------------------------------------
+
+    def _get_cache(self) -> Optional[TranslationCache]:
+        if self._cache is None:
+            try:
+                os.makedirs(VALVES_DIR, exist_ok=True)
+                self._cache = TranslationCache(
+                    os.path.join(VALVES_DIR, "translation_cache.sqlite")
+                )
+            except Exception as e:
+                log.error(f"Translation cache unavailable: {e}")
+        return self._cache
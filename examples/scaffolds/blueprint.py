@@ -8,12 +8,23 @@ description: Demonstrates user context, file operations, and model callbacks via
 
 from typing import Generator, Iterator, List, Optional, Union
 from pydantic import BaseModel, Field
-import json
+import io
 import logging
+import orjson
 import requests
 
 log = logging.getLogger(__name__)
 
+# Shared keep-alive session: the three calls in pipe() go to the same host
+_SESSION = requests.Session()
+
+# Upstream SSE framing, matched on the raw bytes of each line
+_SSE_DATA = b"data: "
+_SSE_DONE = b"[DONE]"
+
+# Upper bound on content deltas coalesced into one yielded chunk
+_COALESCE_CHARS = 4096
+
 
 # ---------------------------------------------------------------------------
 # Event helpers – yield these from pipe() to send structured events to the UI
@@ -36,6 +47,70 @@ def emit_status(
         }
     }
 
+
+def _iter_sse_batches(response, chunk_size: int = 8192):
+    """Yield the lines completed by each read of a streamed response.
+
+    Reads large chunks and splits them in a rolling buffer, instead of
+    ``iter_lines`` building and decoding a new string per line.  Lines are
+    bytes without line endings, grouped per read so callers can tell which
+    ones were already buffered together.
+    """
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        buf += chunk
+        lines = []
+        start = 0
+        # Slicing the view copies each line once (a bytearray slice would
+        # copy it again on the way to bytes)
+        with memoryview(buf) as view:
+            while (end := buf.find(b"\n", start)) != -1:
+                stop = end - 1 if end > start and buf[end - 1] == 0x0D else end
+                lines.append(bytes(view[start:stop]))
+                start = end + 1
+        del buf[:start]
+        if lines:
+            yield lines
+    if buf:
+        yield [bytes(buf).rstrip(b"\r")]
+
+
+def _iter_sse_content(response, max_chars: int = _COALESCE_CHARS):
+    """Yield the content deltas of an SSE chat completion stream.
+
+    Deltas that arrived in the same read are joined into one string (up to
+    *max_chars*), so a burst of tokens costs one yield instead of one each.
+    """
+    pending = []
+    size = 0
+    for lines in _iter_sse_batches(response):
+        for raw_line in lines:
+            # Also skips blank keep-alive lines
+            if not raw_line.startswith(_SSE_DATA):
+                continue
+            # orjson parses the view directly, without copying the payload
+            payload = memoryview(raw_line)[len(_SSE_DATA):]
+            if payload == _SSE_DONE:
+                if pending:
+                    yield "".join(pending)
+                return
+            try:
+                chunk = orjson.loads(payload)
+                content = chunk["choices"][0]["delta"].get("content")
+            except (orjson.JSONDecodeError, KeyError, IndexError):
+                continue
+            if content:
+                pending.append(content)
+                size += len(content)
+                if size >= max_chars:
+                    yield "".join(pending)
+                    pending.clear()
+                    size = 0
+        if pending:
+            yield "".join(pending)
+            pending.clear()
+            size = 0
+
 # ---------------------------------------------------------------------------
 # Pipeline
 # ---------------------------------------------------------------------------
@@ -113,35 +188,29 @@ class Pipeline:
         yield emit_status(f"Calling {self.valves.model}")
         yield f"**{self.valves.model}** says:\n\n"
 
-        assistant_reply = ""
+        reply_parts = []
         try:
-            r = requests.post(
+            # Closing the response releases its pooled connection even when
+            # the stream is cut short by an error or a client disconnect
+            with _SESSION.post(
                 f"{base_url}/api/chat/completions",
                 headers={**headers, "Content-Type": "application/json"},
-                json={
+                data=orjson.dumps({
                     "model": self.valves.model,
                     "messages": messages,
                     "stream": True,
-                },
+                }),
                 stream=True,
-            )
-            r.raise_for_status()
-
-            for raw_line in r.iter_lines(decode_unicode=True):
-                if not raw_line:
-                    continue
-                line = raw_line.removeprefix("data: ").strip()
-                if line == "[DONE]":
-                    break
-                try:
-                    chunk = json.loads(line)
-                    delta = chunk["choices"][0].get("delta", {})
-                    content = delta.get("content", "")
-                    if content:
-                        assistant_reply += content
-                        yield content
-                except (json.JSONDecodeError, KeyError, IndexError):
-                    continue
+            ) as r:
+                r.raise_for_status()
+
+                # No reader thread needed here: the server drains sync pipes
+                # on a producer thread into a bounded queue, so this loop
+                # keeps reading the socket while earlier chunks are sent to
+                # the client
+                for content in _iter_sse_content(r):
+                    reply_parts.append(content)
+                    yield content
         except Exception as e:
             yield f"\n\nModel call failed: {e}\n"
 
@@ -150,10 +219,13 @@ class Pipeline:
         # -- 3. Upload transcript file -----------------------------------------
         yield emit_status("Saving transcript")
 
-        transcript = (
-            f"User: {user_message}\n\n"
-            f"Assistant ({self.valves.model}):\n{assistant_reply}\n"
-        )
+        # Joined and encoded once, however many deltas the reply streamed in
+        reply_parts.append("\n")
+        transcript = "".join([
+            f"User: {user_message}\n\n",
+            f"Assistant ({self.valves.model}):\n",
+            *reply_parts,
+        ]).encode()
 
         file_url = self._upload_transcript(base_url, headers, transcript)
         if file_url:
@@ -167,26 +239,36 @@ class Pipeline:
 
     def _list_files(self, base_url: str, headers: dict) -> list:
         try:
-            r = requests.get(f"{base_url}/api/v1/files/", headers=headers)
+            # requests already sends Accept-Encoding: gzip, deflate; asking
+            # for JSON explicitly keeps proxies from serving anything else
+            r = _SESSION.get(
+                f"{base_url}/api/v1/files/",
+                headers={**headers, "Accept": "application/json"},
+            )
             r.raise_for_status()
-            return r.json()
+            return orjson.loads(r.content)
         except Exception as e:
             log.error(f"Failed to list files: {e}")
             return []
 
     def _upload_transcript(
-        self, base_url: str, headers: dict, content: str
+        self, base_url: str, headers: dict, content: bytes
     ) -> Optional[str]:
         try:
-            r = requests.post(
+            r = _SESSION.post(
                 f"{base_url}/api/v1/files/",
                 headers=headers,
                 files={
-                    "file": ("transcript.md", content.encode(), "text/markdown")
+                    "file": (
+                        "transcript.md",
+                        io.BytesIO(content),
+                        "text/markdown",
+                    )
                 },
+                stream=False,
             )
             r.raise_for_status()
-            file_id = r.json()["id"]
+            file_id = orjson.loads(r.content)["id"]
             return f"{base_url}/api/v1/files/{file_id}/content"
         except Exception as e:
             log.error(f"Failed to upload transcript: {e}")
@@ -1,29 +1,43 @@
-from fastapi import FastAPI, Request, Depends, status, HTTPException
+from fastapi import FastAPI, Depends, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
 
 
-from starlette.responses import StreamingResponse, Response
-from pydantic import BaseModel, ConfigDict
-from typing import List, Union, Generator, Iterator
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from pydantic import BaseModel
+from typing import Any, Callable, Optional, Union, Generator, Iterator
 
 
-from utils.pipelines.auth import bearer_security, get_current_user
+from utils.pipelines.auth import get_current_user
 from utils.pipelines.main import get_last_user_message, stream_message_template
 from contextlib import asynccontextmanager
+from functools import partial
+from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
 from schemas import OpenAIChatCompletionForm
 
-import shutil
 import os
+import asyncio
 import importlib.util
+import inspect
 import logging
+import re
 import time
-import json
+import orjson
 import uuid
 import sys
+import threading
+
+from config import (
+    API_KEY,
+    PIPELINES_DIR,
+    VALVES_DIR,
+    LOG_LEVELS,
+    THREAD_POOL_SIZE,
+    STREAM_QUEUE_SIZE,
+)
 
-from config import API_KEY, PIPELINES_DIR, VALVES_DIR, LOG_LEVELS
+log = logging.getLogger(__name__)
 
 if not os.path.exists(PIPELINES_DIR):
     os.makedirs(PIPELINES_DIR)
@@ -38,10 +52,19 @@ def _migrate_valves_to_new_dir():
     1. Single-file pipelines: e.g. blueprint.py + blueprint/valves.json
     2. Package pipelines: e.g. my_agent/__init__.py + my_agent/valves.json
     """
-    for entry in os.listdir(PIPELINES_DIR):
-        entry_path = os.path.join(PIPELINES_DIR, entry)
-        if not os.path.isdir(entry_path) or entry.startswith(".") or entry == "failed":
-            continue
+    import shutil  # only needed for one-off legacy migrations
+
+    # Collect first: single-file legacy directories are removed below
+    with os.scandir(PIPELINES_DIR) as it:
+        entries = [
+            e
+            for e in it
+            if e.is_dir() and not e.name.startswith(".") and e.name != "failed"
+        ]
+
+    for dir_entry in entries:
+        entry = dir_entry.name
+        entry_path = dir_entry.path
 
         old_valves = os.path.join(entry_path, "valves.json")
         if not os.path.exists(old_valves):
@@ -53,11 +76,11 @@ def _migrate_valves_to_new_dir():
         if not os.path.exists(new_valves):
             os.makedirs(new_dir, exist_ok=True)
             shutil.move(old_valves, new_valves)
-            logging.info(f"Migrated valves.json: {old_valves} -> {new_valves}")
+            log.info("Migrated valves.json: %s -> %s", old_valves, new_valves)
         else:
             # New location already has the file, just remove the old one
             os.remove(old_valves)
-            logging.info(f"Removed duplicate legacy valves.json: {old_valves}")
+            log.info("Removed duplicate legacy valves.json: %s", old_valves)
 
         has_init = os.path.exists(os.path.join(entry_path, "__init__.py"))
         if has_init:
@@ -65,18 +88,33 @@ def _migrate_valves_to_new_dir():
             continue
 
         # Single-file pipeline — clean up the now-empty directory
-        remaining = [f for f in os.listdir(entry_path) if f != "__pycache__"]
-        if not remaining:
+        with os.scandir(entry_path) as it:
+            empty = not any(f.name != "__pycache__" for f in it)
+        if empty:
             shutil.rmtree(entry_path)
-            logging.info(f"Removed empty legacy directory: {entry_path}")
+            log.info("Removed empty legacy directory: %s", entry_path)
 
 
 _migrate_valves_to_new_dir()
 
 
-PIPELINES = {}
-PIPELINE_MODULES = {}
-PIPELINE_NAMES = {}
+@dataclass(slots=True)
+class RegisteredPipeline:
+    """A loaded pipeline plus the metadata the handlers need, resolved once."""
+
+    id: str
+    name: str
+    module_name: str
+    pipeline: Any
+    has_valves: bool
+    valves_cls: Optional[type]
+    pipe_fn: Callable
+    pipe_is_async: bool
+    # Pre-serialized body for the valves spec endpoint (the class is fixed)
+    valves_schema_json: Optional[bytes] = None
+
+
+REGISTRY: dict[str, RegisteredPipeline] = {}
 
 # Add GLOBAL_LOG_LEVEL for Pipelines
 log_level = os.getenv("GLOBAL_LOG_LEVEL", "INFO").upper()
@@ -90,47 +128,39 @@ for _uv_name in ("uvicorn", "uvicorn.error", "uvicorn.access", "watchfiles", "wa
         _handler.setFormatter(_log_formatter)
 
 
-def get_all_pipelines():
-    pipelines = {}
-    for pipeline_id in PIPELINE_MODULES.keys():
-        pipeline = PIPELINE_MODULES[pipeline_id]
-        pipelines[pipeline_id] = {
-            "module": pipeline_id,
-            "id": pipeline_id,
-            "name": (pipeline.name if hasattr(pipeline, "name") else pipeline_id),
-            "valves": pipeline.valves if hasattr(pipeline, "valves") else None,
-        }
-
-    return pipelines
+# "key: value" lines; tolerates indentation and CRLF line endings
+_FRONTMATTER_LINE = re.compile(
+    r"^[ \t]*([^:\s][^:\r\n]*?)[ \t]*:[ \t]*(.*?)[ \t]*\r?$", re.M
+)
 
 
 def parse_frontmatter(content):
-    frontmatter = {}
-    for line in content.split("\n"):
-        if ":" in line:
-            key, value = line.split(":", 1)
-            frontmatter[key.strip().lower()] = value.strip()
-    return frontmatter
+    return {
+        m.group(1).lower(): m.group(2)
+        for m in _FRONTMATTER_LINE.finditer(content)
+    }
 
 
-async def load_module_from_path(module_name, module_path):
+def load_module_from_path(module_name, module_path):
+    """Import a single-file pipeline. Blocking: run it in an executor."""
 
     try:
         # Load the module
         spec = importlib.util.spec_from_file_location(module_name, module_path)
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
-        logging.info(f"Loaded module: {module.__name__}")
+        log.info("Loaded module: %s", module.__name__)
         if hasattr(module, "Pipeline"):
             return module.Pipeline()
         else:
             raise Exception("No Pipeline class found")
     except Exception as e:
-        logging.error(f"Error loading module: {module_name}: {e}")
+        log.error("Error loading module: %s: %s", module_name, e)
     return None
 
 
-async def load_package_from_directory(package_name, package_path):
+def load_package_from_directory(package_name, package_path):
+    """Import a package pipeline. Blocking: run it in an executor."""
     try:
         init_path = os.path.join(package_path, "__init__.py")
 
@@ -143,118 +173,154 @@ async def load_package_from_directory(package_name, package_path):
         module = importlib.util.module_from_spec(spec)
         sys.modules[package_name] = module
         spec.loader.exec_module(module)
-        logging.info(f"Loaded package: {package_name}")
+        log.info("Loaded package: %s", package_name)
 
         if hasattr(module, "Pipeline"):
             return module.Pipeline()
         else:
             raise Exception("No Pipeline class found")
     except Exception as e:
-        logging.error(f"Error loading package: {package_name}: {e}")
+        log.error("Error loading package: %s: %s", package_name, e)
     return None
 
 
 def _register_pipeline(pipeline, module_name):
-    """Register a pipeline: set up valves.json and add to global registries."""
-    global PIPELINE_MODULES, PIPELINE_NAMES
-
+    """Register a pipeline: set up valves.json and add it to REGISTRY."""
     subfolder_path = os.path.join(VALVES_DIR, module_name)
-    if not os.path.exists(subfolder_path):
-        os.makedirs(subfolder_path)
-        logging.info(f"Created subfolder: {subfolder_path}")
+    os.makedirs(subfolder_path, exist_ok=True)
 
     valves_json_path = os.path.join(subfolder_path, "valves.json")
-    if not os.path.exists(valves_json_path):
-        with open(valves_json_path, "w") as f:
-            json.dump({}, f)
-        logging.info(f"Created valves.json in: {subfolder_path}")
-
-    # Overwrite pipeline.valves with values from valves.json
-    if os.path.exists(valves_json_path):
-        with open(valves_json_path, "r") as f:
-            valves_json = json.load(f)
-            if hasattr(pipeline, "valves"):
+    try:
+        # "x" creates the file only if it is missing, in one syscall
+        with open(valves_json_path, "xb") as f:
+            f.write(b"{}")
+        log.info("Created valves.json in: %s", subfolder_path)
+    except FileExistsError:
+        # Overwrite pipeline.valves with values from valves.json
+        if hasattr(pipeline, "valves"):
+            with open(valves_json_path, "rb") as f:
+                valves_json = orjson.loads(f.read())
+            # An empty file keeps the pipeline's own valves; otherwise
+            # overlay the saved values on them and validate once
+            if valves_json:
                 ValvesModel = pipeline.valves.__class__
-                combined_valves = {
-                    **pipeline.valves.model_dump(),
-                    **valves_json,
-                }
-                valves = ValvesModel(**combined_valves)
-                pipeline.valves = valves
-                logging.info(f"Updated valves for module: {module_name}")
-
-    pipeline_id = pipeline.id if hasattr(pipeline, "id") else module_name
-    PIPELINE_MODULES[pipeline_id] = pipeline
-    PIPELINE_NAMES[pipeline_id] = module_name
-    logging.info(f"Loaded module: {module_name}")
+                pipeline.valves = ValvesModel.model_validate(
+                    {**pipeline.valves.model_dump(), **valves_json}
+                )
+                log.info("Updated valves for module: %s", module_name)
+
+    pipeline_id = getattr(pipeline, "id", module_name)
+    has_valves = hasattr(pipeline, "valves")
+    entry = RegisteredPipeline(
+        id=pipeline_id,
+        name=getattr(pipeline, "name", pipeline_id),
+        module_name=module_name,
+        pipeline=pipeline,
+        has_valves=has_valves,
+        valves_cls=pipeline.valves.__class__ if has_valves else None,
+        pipe_fn=pipeline.pipe,
+        pipe_is_async=inspect.isasyncgenfunction(pipeline.pipe),
+    )
+    if has_valves:
+        entry.valves_schema_json = orjson.dumps(
+            entry.valves_cls.model_json_schema()
+        )
+    REGISTRY[pipeline_id] = entry
+    log.info("Loaded module: %s", module_name)
 
 
 async def load_modules_from_directory(directory):
-    global PIPELINE_MODULES
-    global PIPELINE_NAMES
-
-    loaded_single_files = set()
-
-    # Pass 1: Load single .py files (existing behavior)
-    for filename in os.listdir(directory):
-        if filename.endswith(".py"):
-            module_name = filename[:-3]  # Remove the .py extension
-            module_path = os.path.join(directory, filename)
-
-            pipeline = await load_module_from_path(module_name, module_path)
-            if pipeline:
-                _register_pipeline(pipeline, module_name)
-                loaded_single_files.add(module_name)
-            else:
-                logging.warning(f"No Pipeline class found in {module_name}")
-
-    # Pass 2: Load package pipelines (directories with __init__.py)
-    for entry in os.listdir(directory):
-        if entry.startswith("."):
-            continue
-        entry_path = os.path.join(directory, entry)
-        if not os.path.isdir(entry_path):
-            continue
-        if entry in loaded_single_files:
-            continue
-        init_path = os.path.join(entry_path, "__init__.py")
-        if not os.path.exists(init_path):
-            continue
-
-        pipeline = await load_package_from_directory(entry, entry_path)
+    loop = asyncio.get_running_loop()
+
+    # Classify every entry in one directory walk: single .py files and
+    # package pipelines (directories with __init__.py)
+    single_files, packages = [], []
+    with os.scandir(directory) as it:
+        for e in it:
+            if e.name.endswith(".py") and e.is_file():
+                single_files.append((e.name[:-3], e.path))  # Remove .py
+            elif not e.name.startswith(".") and e.is_dir():
+                if os.path.exists(os.path.join(e.path, "__init__.py")):
+                    packages.append((e.name, e.path))
+
+    # A single file takes precedence over a same-named package
+    single_names = {name for name, _ in single_files}
+    packages = [p for p in packages if p[0] not in single_names]
+
+    # Imports are blocking, so each pipeline is imported on the default
+    # executor and all of them load concurrently. Registration touches the
+    # global registries and stays on the event loop: single files first,
+    # then packages, each in directory order.
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(None, load_module_from_path, name, path)
+            for name, path in single_files
+        ),
+        *(
+            loop.run_in_executor(None, load_package_from_directory, name, path)
+            for name, path in packages
+        ),
+    )
+
+    for i, ((name, _), pipeline) in enumerate(
+        zip(single_files + packages, results)
+    ):
         if pipeline:
-            _register_pipeline(pipeline, entry)
+            _register_pipeline(pipeline, name)
+        elif i < len(single_files):
+            log.warning("No Pipeline class found in %s", name)
         else:
-            logging.warning(f"No Pipeline class found in package {entry}")
-
-    global PIPELINES
-    PIPELINES = get_all_pipelines()
+            log.warning("No Pipeline class found in package %s", name)
 
 
 async def on_startup():
     await load_modules_from_directory(PIPELINES_DIR)
 
-    for module in PIPELINE_MODULES.values():
-        if hasattr(module, "on_startup"):
-            await module.on_startup()
+    for entry in REGISTRY.values():
+        if hasattr(entry.pipeline, "on_startup"):
+            await entry.pipeline.on_startup()
 
 
 async def on_shutdown():
-    for module in PIPELINE_MODULES.values():
-        if hasattr(module, "on_shutdown"):
-            await module.on_shutdown()
+    for entry in REGISTRY.values():
+        if hasattr(entry.pipeline, "on_shutdown"):
+            await entry.pipeline.on_shutdown()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Every sync pipe call and streaming producer runs on the default
+    # executor, so THREAD_POOL_SIZE bounds the threads pipes can hold
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE)
+    )
     await on_startup()
     yield
     await on_shutdown()
 
 
-app = FastAPI(docs_url="/docs", redoc_url=None, lifespan=lifespan)
+# Pipes return arbitrary Python data: stringify non-str dict keys (as the
+# stdlib json module does) and accept numpy arrays and scalars
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
 
-app.state.PIPELINES = PIPELINES
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    Defined here rather than imported from fastapi.responses, where recent
+    FastAPI releases deprecate it in favour of response models.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=_ORJSON_OPTIONS)
+
+
+app = FastAPI(
+    docs_url="/docs",
+    redoc_url=None,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 
 origins = ["*"]
@@ -269,15 +335,36 @@ app.add_middleware(
 )
 
 
-@app.middleware("http")
-async def check_url(request: Request, call_next):
-    start_time = int(time.time())
-    app.state.PIPELINES = get_all_pipelines()
-    response = await call_next(request)
-    process_time = int(time.time()) - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+class ProcessTimeMiddleware:
+    """Pure ASGI middleware adding an X-Process-Time header (seconds)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
 
-    return response
+        async def send_with_process_time(message):
+            if message["type"] == "http.response.start":
+                process_time = time.perf_counter() - start_time
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-process-time", str(process_time).encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
+
+
+# Compress larger JSON bodies (e.g. /models). Starlette >= 0.46 (pinned in
+# requirements.txt) skips text/event-stream, so SSE chunks are flushed as
+# they are produced instead of waiting in the gzip buffer
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+app.add_middleware(ProcessTimeMiddleware)
 
 
 @app.get("/v1/models")
@@ -286,20 +373,19 @@ async def get_models(user: str = Depends(get_current_user)):
     """
     Returns the available pipelines
     """
-    app.state.PIPELINES = get_all_pipelines()
     return {
         "data": [
             {
-                "id": pipeline["id"],
-                "name": pipeline["name"],
+                "id": entry.id,
+                "name": entry.name,
                 "object": "model",
                 "created": int(time.time()),
                 "owned_by": "openai",
                 "pipeline": {
-                    "valves": pipeline["valves"] != None,
+                    "valves": entry.has_valves,
                 },
             }
-            for pipeline in app.state.PIPELINES.values()
+            for entry in REGISTRY.values()
         ],
         "object": "list",
         "pipelines": True,
@@ -319,15 +405,11 @@ async def list_pipelines(user: str = Depends(get_current_user)):
         return {
             "data": [
                 {
-                    "id": pipeline_id,
-                    "name": PIPELINE_NAMES[pipeline_id],
-                    "valves": (
-                        True
-                        if hasattr(PIPELINE_MODULES[pipeline_id], "valves")
-                        else False
-                    ),
+                    "id": entry.id,
+                    "name": entry.module_name,
+                    "valves": entry.has_valves,
                 }
-                for pipeline_id in list(PIPELINE_MODULES.keys())
+                for entry in list(REGISTRY.values())
             ]
         }
     else:
@@ -337,81 +419,64 @@ async def list_pipelines(user: str = Depends(get_current_user)):
         )
 
 
-@app.get("/v1/{pipeline_id}/valves")
-@app.get("/{pipeline_id}/valves")
-async def get_valves(pipeline_id: str):
-    if pipeline_id not in PIPELINE_MODULES:
+def _get_valves_entry(pipeline_id: str) -> RegisteredPipeline:
+    """Return the registry entry for *pipeline_id*, or 404 if it has no valves."""
+    entry = REGISTRY.get(pipeline_id)
+    if entry is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {pipeline_id} not found",
         )
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
-
-    if hasattr(pipeline, "valves") is False:
+    if not entry.has_valves:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Valves for {pipeline_id} not found",
         )
 
-    return pipeline.valves
+    return entry
+
+
+@app.get("/v1/{pipeline_id}/valves")
+@app.get("/{pipeline_id}/valves")
+async def get_valves(pipeline_id: str):
+    entry = _get_valves_entry(pipeline_id)
+    # Serialized per request: on_startup / on_valves_updated may change the
+    # live valves after registration or an update
+    return Response(
+        entry.pipeline.valves.model_dump_json(), media_type="application/json"
+    )
 
 
 @app.get("/v1/{pipeline_id}/valves/spec")
 @app.get("/{pipeline_id}/valves/spec")
 async def get_valves_spec(pipeline_id: str):
-    if pipeline_id not in PIPELINE_MODULES:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Pipeline {pipeline_id} not found",
-        )
-
-    pipeline = PIPELINE_MODULES[pipeline_id]
-
-    if hasattr(pipeline, "valves") is False:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Valves for {pipeline_id} not found",
-        )
-
-    return pipeline.valves.schema()
+    entry = _get_valves_entry(pipeline_id)
+    return Response(entry.valves_schema_json, media_type="application/json")
 
 
 @app.post("/v1/{pipeline_id}/valves/update")
 @app.post("/{pipeline_id}/valves/update")
 async def update_valves(pipeline_id: str, form_data: dict):
-
-    if pipeline_id not in PIPELINE_MODULES:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Pipeline {pipeline_id} not found",
-        )
-
-    pipeline = PIPELINE_MODULES[pipeline_id]
-
-    if hasattr(pipeline, "valves") is False:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Valves for {pipeline_id} not found",
-        )
+    entry = _get_valves_entry(pipeline_id)
+    pipeline = entry.pipeline
 
     try:
-        ValvesModel = pipeline.valves.__class__
-        valves = ValvesModel(**form_data)
+        valves = entry.valves_cls.model_validate(form_data)
         pipeline.valves = valves
 
         # Determine the directory path for the valves.json file
-        valve_dir = os.path.join(VALVES_DIR, PIPELINE_NAMES[pipeline_id])
+        valve_dir = os.path.join(VALVES_DIR, entry.module_name)
         valves_json_path = os.path.join(valve_dir, "valves.json")
 
         # Save the updated valves data back to the valves.json file
         with open(valves_json_path, "w") as f:
-            json.dump(valves.model_dump(), f)
+            f.write(valves.model_dump_json())
 
         if hasattr(pipeline, "on_valves_updated"):
             await pipeline.on_valves_updated()
     except Exception as e:
-        logging.error(f"Error updating valves: {e}")
+        log.error("Error updating valves: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"{str(e)}",
@@ -420,130 +485,229 @@ async def update_valves(pipeline_id: str, form_data: dict):
     return pipeline.valves
 
 
+# Queued after the last chunk of a sync pipe
+_STREAM_END = object()
+
+
+@dataclass(slots=True)
+class _StreamError:
+    """Carries an exception raised by a sync pipe to the SSE consumer."""
+
+    error: Exception
+
+
+def _produce_stream(iterator, queue: asyncio.Queue, loop, stop: threading.Event):
+    """Feed *iterator* into *queue* from a worker thread.
+
+    Stops early once *stop* is set (the consumer went away); the iterator is
+    closed in this thread, where it was being advanced.
+    """
+
+    def put(item) -> bool:
+        if stop.is_set():
+            return False
+        try:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+        except RuntimeError:  # event loop closed
+            return False
+        return True
+
+    try:
+        for item in iterator:
+            if not put(item):
+                break
+        else:
+            put(_STREAM_END)
+    except Exception as e:
+        if put(_StreamError(e)):
+            put(_STREAM_END)
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+
+
+class _StreamEncoder:
+    """Formats the SSE frames of one streamed response.
+
+    The chunk dict is built once per response; each content frame only swaps
+    the delta text before serializing, and every frame shares the same id.
+    """
+
+    __slots__ = ("chunk", "choice")
+
+    def __init__(self, model: str):
+        self.chunk = stream_message_template(model, None)
+        self.choice = self.chunk["choices"][0]
+
+    def content(self, text) -> bytes:
+        self.choice["delta"]["content"] = text
+        return b"data: " + orjson.dumps(self.chunk) + b"\n\n"
+
+    def line(self, line) -> Union[str, bytes]:
+        """Turn one item yielded by a pipe into an SSE frame."""
+        if isinstance(line, BaseModel):
+            return f"data: {line.model_dump_json()}\n\n"
+        if isinstance(line, dict):
+            return b"data: " + orjson.dumps(line, option=_ORJSON_OPTIONS) + b"\n\n"
+
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+            log.debug("stream_content:Generator:%s", line)
+
+        if isinstance(line, str) and line.startswith("data:"):
+            return f"{line}\n\n"
+        return self.content(line)
+
+    def finish(self) -> bytes:
+        """Return the final stop chunk followed by the [DONE] sentinel."""
+        self.choice["delta"] = {}
+        self.choice["finish_reason"] = "stop"
+        return b"data: " + orjson.dumps(self.chunk) + b"\n\ndata: [DONE]"
+
+
+def _completion_response(model: str, message: str) -> dict:
+    return {
+        "id": f"{model}-{str(uuid.uuid4())}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": message,
+                },
+                "logprobs": None,
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+async def async_job(form_data: OpenAIChatCompletionForm, pipe_kwargs: dict):
+    """Serve a pipe defined as an async generator directly on the event loop."""
+    pipeline_id = form_data.model
+    res = REGISTRY[pipeline_id].pipe_fn(**pipe_kwargs)
+
+    if form_data.stream:
+
+        async def stream_content():
+            encoder = _StreamEncoder(pipeline_id)
+            async for line in res:
+                yield encoder.line(line)
+            yield encoder.finish()
+
+        return StreamingResponse(stream_content(), media_type="text/event-stream")
+
+    message = ""
+    async for stream in res:
+        message = f"{message}{stream}"
+
+    log.debug("stream:false:%s", message)
+    return _completion_response(pipeline_id, message)
+
+
 @app.post("/v1/chat/completions")
 @app.post("/chat/completions")
 async def generate_openai_chat_completion(form_data: OpenAIChatCompletionForm):
-    messages = [message.model_dump() for message in form_data.messages]
-    user_message = get_last_user_message(messages)
-
-    if form_data.model not in app.state.PIPELINES:
+    if form_data.model not in REGISTRY:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {form_data.model} not found",
         )
 
-    def job():
-        pipeline_id = form_data.model
-        pipe = PIPELINE_MODULES[pipeline_id].pipe
-        body = form_data.model_dump()
-        user = body.get("user")
-
-        logging.info(
-            f"chat/completions: pipeline={pipeline_id} "
-            f"user={user.get('id') if user else 'anonymous'}"
-        )
+    # One dump serves both the pipe's body and its messages
+    pipeline_id = form_data.model
+    body = form_data.model_dump(mode="python")
+    messages = body["messages"]
+    user = body.get("user")
+
+    log.info(
+        "chat/completions: pipeline=%s user=%s",
+        pipeline_id,
+        user.get("id") if user else "anonymous",
+    )
+
+    pipe_kwargs = {
+        "user_message": get_last_user_message(messages),
+        "model_id": pipeline_id,
+        "messages": messages,
+        "body": body,
+        "user": user,
+    }
 
-        if form_data.stream:
+    if REGISTRY[pipeline_id].pipe_is_async:
+        # Async pipes run on the event loop; no worker thread per request
+        return await async_job(form_data, pipe_kwargs)
+
+    pipe = REGISTRY[pipeline_id].pipe_fn
+
+    if form_data.stream:
+
+        async def stream_content():
+            loop = asyncio.get_running_loop()
+            res = await loop.run_in_executor(None, partial(pipe, **pipe_kwargs))
+            log.debug("stream:true:%s", res)
+
+            encoder = _StreamEncoder(pipeline_id)
+
+            if isinstance(res, str):
+                log.debug("stream_content:str:%s", res)
+                yield encoder.content(res)
+                yield encoder.finish()
+                return
+
+            if not isinstance(res, Iterator):
+                return
+
+            # A producer on the default executor (THREAD_POOL_SIZE workers)
+            # drains the pipe into a bounded queue: it runs ahead of a slow
+            # client by at most STREAM_QUEUE_SIZE chunks and then blocks
+            # until the client catches up
+            queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+            stop = threading.Event()
+            loop.run_in_executor(None, _produce_stream, res, queue, loop, stop)
+            try:
+                while True:
+                    line = await queue.get()
+                    if line is _STREAM_END:
+                        break
+                    if isinstance(line, _StreamError):
+                        raise line.error
+                    yield encoder.line(line)
+            finally:
+                # Client gone or stream done: stop the producer and free
+                # any put() it is blocked on
+                stop.set()
+                while not queue.empty():
+                    queue.get_nowait()
+
+            if isinstance(res, Generator):
+                yield encoder.finish()
+
+        return StreamingResponse(stream_content(), media_type="text/event-stream")
 
-            def stream_content():
-                res = pipe(
-                    user_message=user_message,
-                    model_id=pipeline_id,
-                    messages=messages,
-                    body=body,
-                    user=user,
-                )
-                logging.debug(f"stream:true:{res}")
-
-                if isinstance(res, str):
-                    message = stream_message_template(form_data.model, res)
-                    logging.debug(f"stream_content:str:{message}")
-                    yield f"data: {json.dumps(message)}\n\n"
-
-                if isinstance(res, Iterator):
-                    for line in res:
-                        if isinstance(line, BaseModel):
-                            line = line.model_dump_json()
-                            line = f"data: {line}"
-
-                        elif isinstance(line, dict):
-                            line = json.dumps(line)
-                            line = f"data: {line}"
-
-                        try:
-                            line = line.decode("utf-8")
-                            logging.debug(f"stream_content:Generator:{line}")
-                        except:
-                            pass
-
-                        if isinstance(line, str) and line.startswith("data:"):
-                            yield f"{line}\n\n"
-                        else:
-                            line = stream_message_template(form_data.model, line)
-                            yield f"data: {json.dumps(line)}\n\n"
-
-                if isinstance(res, str) or isinstance(res, Generator):
-                    finish_message = {
-                        "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": form_data.model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {},
-                                "logprobs": None,
-                                "finish_reason": "stop",
-                            }
-                        ],
-                    }
-
-                    yield f"data: {json.dumps(finish_message)}\n\n"
-                    yield f"data: [DONE]"
-
-            return StreamingResponse(stream_content(), media_type="text/event-stream")
+    def job():
+        res = pipe(**pipe_kwargs)
+        log.debug("stream:false:%s", res)
+
+        if isinstance(res, dict):
+            return res
+        elif isinstance(res, BaseModel):
+            return res.model_dump()
         else:
-            res = pipe(
-                user_message=user_message,
-                model_id=pipeline_id,
-                messages=messages,
-                body=body,
-                user=user,
-            )
-            logging.debug(f"stream:false:{res}")
-
-            if isinstance(res, dict):
-                return res
-            elif isinstance(res, BaseModel):
-                return res.model_dump()
-            else:
-
-                message = ""
-
-                if isinstance(res, str):
-                    message = res
-
-                if isinstance(res, Generator):
-                    for stream in res:
-                        message = f"{message}{stream}"
-
-                logging.debug(f"stream:false:{message}")
-                return {
-                    "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": form_data.model,
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": message,
-                            },
-                            "logprobs": None,
-                            "finish_reason": "stop",
-                        }
-                    ],
-                }
 
-    return await run_in_threadpool(job)
+            message = ""
+
+            if isinstance(res, str):
+                message = res
+
+            if isinstance(res, Generator):
+                for stream in res:
+                    message = f"{message}{stream}"
+
+            log.debug("stream:false:%s", message)
+            return _completion_response(form_data.model, message)
+
+    return await asyncio.get_running_loop().run_in_executor(None, job)
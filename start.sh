@@ -3,6 +3,7 @@ PORT="${PORT:-9099}"
 HOST="${HOST:-0.0.0.0}"
 PIPELINES_DIR="${PIPELINES_DIR:-./pipelines}"
 UVICORN_LOOP="${UVICORN_LOOP:-auto}"
+UVICORN_HTTP="${UVICORN_HTTP:-auto}"
 
 if [[ "${INSTALL_REQUIREMENTS:-false}" == "true" ]]; then
   find -L "$PIPELINES_DIR" -name requirements.txt | while read -r req; do
@@ -13,4 +14,4 @@ else
   echo "INSTALL_REQUIREMENTS=false, skipping pipeline requirements install"
 fi
 
-exec uvicorn main:app --host "$HOST" --port "$PORT" --forwarded-allow-ips '*' --loop "$UVICORN_LOOP" "$@"
+exec uvicorn main:app --host "$HOST" --port "$PORT" --forwarded-allow-ips '*' --loop "$UVICORN_LOOP" --http "$UVICORN_HTTP" "$@"
@@ -1,3 +1,12 @@
 """Shared fixtures for pipeline tests."""
 
+import os
+import tempfile
+
 import pytest
+
+# main.py creates and migrates these directories at import time: keep the
+# server tests away from the checkout's pipelines/ and valves/
+_SERVER_DIR = tempfile.mkdtemp(prefix="pipelines-tests-")
+os.environ.setdefault("PIPELINES_DIR", os.path.join(_SERVER_DIR, "pipelines"))
+os.environ.setdefault("VALVES_DIR", os.path.join(_SERVER_DIR, "valves"))
@@ -1,7 +1,8 @@
 """Tests for the blueprint pipeline."""
 
+import orjson
 import pytest
-from unittest.mock import patch, MagicMock
+from examples.scaffolds import blueprint
 from examples.scaffolds.blueprint import Pipeline
 from tests.helpers import collect_pipe, make_body, make_user
 
@@ -11,15 +12,20 @@ from tests.helpers import collect_pipe, make_body, make_user
 # ---------------------------------------------------------------------------
 
 
+# Read-only parts of every callback body, built once for the module
+_OW_CALLBACK = {
+    "base_url": "http://localhost:8080",
+    "token": "test-token",
+    "chat_id": "chat-1",
+}
+_USER = make_user()
+
+
 def _ow_body(message="hello"):
     """Build a body with __openwebui callback metadata."""
     body = make_body(message)
-    body["__openwebui"] = {
-        "base_url": "http://localhost:8080",
-        "token": "test-token",
-        "chat_id": "chat-1",
-    }
-    body["user"] = make_user()
+    body["__openwebui"] = _OW_CALLBACK
+    body["user"] = _USER
     return body
 
 
@@ -43,34 +49,86 @@ def _collect_with_ow(pipeline, message="hello"):
     return text_chunks, events
 
 
-def _mock_requests(mock_req, files=None, model_chunks=None, upload_id="file-123"):
-    """Wire up mock responses for GET (list files) and POST (model + upload)."""
-    # GET /api/v1/files/
-    list_resp = MagicMock()
-    list_resp.json.return_value = files or []
-    list_resp.raise_for_status = MagicMock()
+def _sse_stream(lines, chunk_size=16):
+    """Join SSE lines and cut them into chunks that split lines mid-way."""
+    data = b"".join(line + b"\n" for line in lines)
+    return [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def _sse_content_lines(chunks):
+    """SSE lines for a model reply streamed as *chunks*, ending in [DONE]."""
+    lines = [
+        f'data: {{"choices":[{{"delta":{{"content":"{c}"}}}}]}}'.encode()
+        for c in chunks
+    ]
+    lines.append(b"data: [DONE]")
+    return lines
+
+
+class _FakeResponse:
+    """Just the parts of ``requests.Response`` the blueprint touches."""
+
+    def __init__(self, content=b"", stream=()):
+        self.content = content
+        self._stream = stream
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-    mock_req.get.return_value = list_resp
+    def close(self):
+        self.closed = True
 
-    # POST responses depend on URL
-    model_resp = MagicMock()
-    model_resp.raise_for_status = MagicMock()
-    sse_lines = []
-    for c in (model_chunks or ["Hello", " world"]):
-        sse_lines.append(f'data: {{"choices":[{{"delta":{{"content":"{c}"}}}}]}}')
-    sse_lines.append("data: [DONE]")
-    model_resp.iter_lines.return_value = sse_lines
+    def raise_for_status(self):
+        pass
 
-    upload_resp = MagicMock()
-    upload_resp.raise_for_status = MagicMock()
-    upload_resp.json.return_value = {"id": upload_id}
+    def iter_content(self, chunk_size=1):
+        return iter(self._stream)
 
-    def post_side_effect(url, **kwargs):
+
+class _FakeSession:
+    """Stands in for the blueprint's ``_SESSION`` and records every call.
+
+    ``get`` serves the file list; ``post`` serves the model stream for
+    ``chat/completions`` URLs and the upload reply for anything else.
+    """
+
+    def __init__(self, files=None, model_chunks=None, upload_id="file-123"):
+        self.gets = []
+        self.posts = []
+        self.list_resp = _FakeResponse(content=orjson.dumps(files or []))
+        model_lines = _sse_content_lines(model_chunks or ["Hello", " world"])
+        self.model_resp = _FakeResponse(stream=_sse_stream(model_lines))
+        self.upload_resp = _FakeResponse(content=orjson.dumps({"id": upload_id}))
+
+    def get(self, url, **kwargs):
+        self.gets.append((url, kwargs))
+        return self.list_resp
+
+    def post(self, url, **kwargs):
+        self.posts.append((url, kwargs))
         if "chat/completions" in url:
-            return model_resp
-        return upload_resp
+            return self.model_resp
+        return self.upload_resp
+
+    def posts_to(self, fragment):
+        """Return the kwargs of each POST whose URL contains *fragment*."""
+        return [kwargs for url, kwargs in self.posts if fragment in url]
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    """Return an installer that swaps a :class:`_FakeSession` in for ``_SESSION``."""
+
+    def install(**kwargs):
+        session = _FakeSession(**kwargs)
+        monkeypatch.setattr(blueprint, "_SESSION", session)
+        return session
 
-    mock_req.post.side_effect = post_side_effect
+    return install
 
 
 # ---------------------------------------------------------------------------
@@ -91,13 +149,12 @@ def test_pipe_without_callback():
 # ---------------------------------------------------------------------------
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_lists_files(mock_req):
+def test_pipe_lists_files(fake_session):
     files = [
         {"meta": {"name": "readme.txt"}},
         {"meta": {"name": "data.csv"}},
     ]
-    _mock_requests(mock_req, files=files)
+    fake_session(files=files)
 
     p = Pipeline()
     text, _ = _collect_with_ow(p)
@@ -107,9 +164,8 @@ def test_pipe_lists_files(mock_req):
     assert "(2)" in combined
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_lists_empty_files(mock_req):
-    _mock_requests(mock_req, files=[])
+def test_pipe_lists_empty_files(fake_session):
+    fake_session(files=[])
 
     p = Pipeline()
     text, _ = _collect_with_ow(p)
@@ -118,10 +174,9 @@ def test_pipe_lists_empty_files(mock_req):
     assert "_(none)_" in combined
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_truncates_file_list(mock_req):
+def test_pipe_truncates_file_list(fake_session):
     files = [{"meta": {"name": f"file{i}.txt"}} for i in range(15)]
-    _mock_requests(mock_req, files=files)
+    fake_session(files=files)
 
     p = Pipeline()
     text, _ = _collect_with_ow(p)
@@ -129,9 +184,8 @@ def test_pipe_truncates_file_list(mock_req):
     assert "5 more" in combined
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_streams_model_response(mock_req):
-    _mock_requests(mock_req, model_chunks=["Good ", "morning"])
+def test_pipe_streams_model_response(fake_session):
+    fake_session(model_chunks=["Good ", "morning"])
 
     p = Pipeline()
     text, _ = _collect_with_ow(p)
@@ -140,9 +194,46 @@ def test_pipe_streams_model_response(mock_req):
     assert "morning" in combined
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_calls_configured_model(mock_req):
-    _mock_requests(mock_req)
+def test_pipe_closes_model_response(fake_session):
+    session = fake_session()
+
+    p = Pipeline()
+    _collect_with_ow(p)
+    assert session.model_resp.closed
+
+
+def test_pipe_skips_non_content_sse_lines(fake_session):
+    session = fake_session()
+    session.model_resp = _FakeResponse(stream=_sse_stream([
+        b"",
+        b": keep-alive",
+        b"data: not json\r",
+        b'data: {"choices":[]}',
+        b'data: {"choices":[{"delta":{"content":"kept"}}]}\r',
+        b"data: [DONE]",
+    ]))
+
+    p = Pipeline()
+    text, _ = _collect_with_ow(p)
+    combined = "".join(text)
+    assert "kept" in combined
+    assert "Model call failed" not in combined
+
+
+def test_pipe_coalesces_buffered_deltas(fake_session):
+    session = fake_session()
+    # Both deltas arrive in a single read
+    session.model_resp = _FakeResponse(stream=_sse_stream(
+        _sse_content_lines(["Good ", "morning"]), chunk_size=4096
+    ))
+
+    p = Pipeline()
+    text, _ = _collect_with_ow(p)
+    assert "Good morning" in text
+
+
+def test_pipe_calls_configured_model(fake_session):
+    session = fake_session()
 
     p = Pipeline()
     p.valves = p.Valves(model="custom/model:7b")
@@ -151,17 +242,13 @@ def test_pipe_calls_configured_model(mock_req):
     assert "custom/model:7b" in combined
 
     # Verify the model was passed in the POST call
-    call_args = [
-        c for c in mock_req.post.call_args_list
-        if "chat/completions" in str(c)
-    ]
-    assert len(call_args) == 1
-    assert call_args[0].kwargs["json"]["model"] == "custom/model:7b"
+    model_calls = session.posts_to("chat/completions")
+    assert len(model_calls) == 1
+    assert orjson.loads(model_calls[0]["data"])["model"] == "custom/model:7b"
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_uploads_transcript(mock_req):
-    _mock_requests(mock_req, upload_id="abc-123")
+def test_pipe_uploads_transcript(fake_session):
+    session = fake_session(upload_id="abc-123")
 
     p = Pipeline()
     text, _ = _collect_with_ow(p, "test message")
@@ -170,16 +257,11 @@ def test_pipe_uploads_transcript(mock_req):
     assert "abc-123" in combined
 
     # Verify upload was called
-    upload_calls = [
-        c for c in mock_req.post.call_args_list
-        if "api/v1/files" in str(c)
-    ]
-    assert len(upload_calls) == 1
+    assert len(session.posts_to("api/v1/files")) == 1
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_emits_status_events(mock_req):
-    _mock_requests(mock_req)
+def test_pipe_emits_status_events(fake_session):
+    fake_session()
 
     p = Pipeline()
     _, events = _collect_with_ow(p)
@@ -188,21 +270,17 @@ def test_pipe_emits_status_events(mock_req):
     assert any(s["done"] for s in statuses), "expected done status"
 
 
-@patch("examples.scaffolds.blueprint.requests")
-def test_pipe_transcript_contains_exchange(mock_req):
-    _mock_requests(mock_req, model_chunks=["The answer is 42"])
+def test_pipe_transcript_contains_exchange(fake_session):
+    session = fake_session(model_chunks=["The answer is 42"])
 
     p = Pipeline()
     _collect_with_ow(p, "what is the meaning of life")
 
     # Find the upload call and check transcript content
-    upload_calls = [
-        c for c in mock_req.post.call_args_list
-        if "api/v1/files" in str(c)
-    ]
+    upload_calls = session.posts_to("api/v1/files")
     assert len(upload_calls) == 1
-    uploaded_files = upload_calls[0].kwargs["files"]
-    transcript_bytes = uploaded_files["file"][1]
+    uploaded_files = upload_calls[0]["files"]
+    transcript_bytes = uploaded_files["file"][1].getvalue()
     transcript = transcript_bytes.decode()
     assert "what is the meaning of life" in transcript
     assert "The answer is 42" in transcript
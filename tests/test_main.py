@@ -0,0 +1,190 @@
+"""Tests for the server's streaming of sync pipes."""
+
+import asyncio
+import threading
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import main
+from schemas import OpenAIChatCompletionForm
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+def _words(*words):
+    yield from words
+
+
+class _GenPipeline:
+    """Sync pipe whose generator is supplied by the test."""
+
+    def __init__(self, make_gen):
+        self.name = "gen"
+        self._make_gen = make_gen
+
+    def pipe(self, user_message, model_id, messages, body, user=None):
+        return self._make_gen()
+
+
+@pytest.fixture
+def register(monkeypatch):
+    """Return a function that registers a sync generator pipe as ``gen``."""
+
+    def install(make_gen):
+        pipeline = _GenPipeline(make_gen)
+        monkeypatch.setitem(main.REGISTRY, "gen", main.RegisteredPipeline(
+            id="gen",
+            name="gen",
+            module_name="gen",
+            pipeline=pipeline,
+            has_valves=False,
+            valves_cls=None,
+            pipe_fn=pipeline.pipe,
+            pipe_is_async=False,
+        ))
+
+    return install
+
+
+async def _stream(stream=True):
+    form = OpenAIChatCompletionForm(
+        model="gen", stream=stream, messages=[{"role": "user", "content": "hi"}]
+    )
+    return await main.generate_openai_chat_completion(form)
+
+
+# ---------------------------------------------------------------------------
+# Streaming
+# ---------------------------------------------------------------------------
+
+
+async def test_stream_yields_chunks_then_done(register):
+    register(lambda: _words("a", "b"))
+
+    response = await _stream()
+    frames = [frame async for frame in response.body_iterator]
+
+    body = b"".join(f if isinstance(f, bytes) else f.encode() for f in frames)
+    assert b'"content":"a"' in body
+    assert b'"content":"b"' in body
+    assert body.endswith(b"data: [DONE]")
+
+
+async def test_stream_propagates_pipe_error(register):
+    def failing():
+        yield "before"
+        raise RuntimeError("pipe broke")
+
+    register(failing)
+
+    response = await _stream()
+    frames = []
+    with pytest.raises(RuntimeError, match="pipe broke"):
+        async for frame in response.body_iterator:
+            frames.append(frame)
+    assert len(frames) == 1
+    assert b'"content":"before"' in frames[0]
+
+
+async def test_stream_stops_pipe_when_consumer_leaves(register):
+    closed = threading.Event()
+    pulled = []
+
+    def endless():
+        try:
+            while True:
+                pulled.append(None)
+                yield "x"
+        finally:
+            closed.set()
+
+    register(endless)
+
+    response = await _stream()
+    body = response.body_iterator
+    await body.__anext__()
+    await body.aclose()
+
+    # The producer closes the generator on its own thread
+    assert await asyncio.to_thread(closed.wait, 5)
+    # ...and stopped pulling once the queue had room for no more
+    assert len(pulled) <= main.STREAM_QUEUE_SIZE + 3
+
+
+async def test_stream_serializes_dicts_with_int_keys(register):
+    register(lambda: iter([{"scores": {1: 0.5}}]))
+
+    response = await _stream()
+    frames = [frame async for frame in response.body_iterator]
+
+    assert frames[0] == b'data: {"scores":{"1":0.5}}\n\n'
+
+
+def test_json_response_accepts_int_keys():
+    assert main.ORJSONResponse({"scores": {1: 0.5}}).body == b'{"scores":{"1":0.5}}'
+
+
+async def test_non_streaming_joins_generator(register):
+    register(lambda: _words("a", "b"))
+
+    response = await _stream(stream=False)
+    assert response["choices"][0]["message"]["content"] == "ab"
+
+
+# ---------------------------------------------------------------------------
+# Valves
+# ---------------------------------------------------------------------------
+
+
+class _ValvesPipeline:
+    """Pipeline whose hooks change its own valves, as real pipelines may."""
+
+    class Valves(BaseModel):
+        level: int = 0
+
+    def __init__(self):
+        self.name = "valved"
+        self.valves = self.Valves()
+
+    async def on_valves_updated(self):
+        self.valves = self.Valves(level=self.valves.level + 100)
+
+    def pipe(self, user_message, model_id, messages, body, user=None):
+        return ""
+
+
+async def test_get_valves_reflects_changes_made_by_hooks(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "VALVES_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "REGISTRY", {})
+    pipeline = _ValvesPipeline()
+    main._register_pipeline(pipeline, "valved")
+
+    # A hook running after registration, like on_startup
+    pipeline.valves = pipeline.Valves(level=1)
+    response = await main.get_valves("valved")
+    assert orjson.loads(response.body) == {"level": 1}
+
+    await main.update_valves("valved", {"level": 2})
+    response = await main.get_valves("valved")
+    assert orjson.loads(response.body) == {"level": 102}
+
+
+def test_sse_responses_are_not_gzipped(register):
+    register(lambda: _words(*["word "] * 500))
+
+    client = TestClient(main.app)
+    response = client.post(
+        "/chat/completions",
+        headers={"Accept-Encoding": "gzip"},
+        json={"model": "gen", "stream": True, "messages": [{"role": "user", "content": "hi"}]},
+    )
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "content-encoding" not in response.headers
+    assert response.text.endswith("data: [DONE]")
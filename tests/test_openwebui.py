@@ -0,0 +1,142 @@
+"""Tests for the Open WebUI callback helpers."""
+
+import pytest
+import requests
+import urllib3.filepost
+
+from utils.pipelines import openwebui
+from utils.pipelines.openwebui import _MultipartBody, find_files_in_messages
+
+
+# ---------------------------------------------------------------------------
+# Multipart upload body
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def fixed_boundary(monkeypatch):
+    """Make requests and _MultipartBody pick the same multipart boundary."""
+    boundary = "testboundary0123456789"
+    monkeypatch.setattr(urllib3.filepost, "choose_boundary", lambda: boundary)
+    monkeypatch.setattr(openwebui, "choose_boundary", lambda: boundary)
+    return boundary
+
+
+@pytest.mark.parametrize(
+    "filename, content, content_type",
+    [
+        ("report_ar.pdf", b"%PDF-1.7\r\n" + bytes(range(256)) * 64, "application/pdf"),
+        ('quo"te ré.md', "# héllo\n".encode(), "text/markdown"),
+        ("empty.txt", b"", "text/plain"),
+    ],
+)
+def test_multipart_body_matches_requests(fixed_boundary, filename, content, content_type):
+    expected = requests.Request(
+        "POST",
+        "http://localhost/api/v1/files/",
+        files={"file": (filename, content, content_type)},
+    ).prepare()
+
+    body = _MultipartBody("file", filename, content, content_type)
+
+    assert b"".join(body) == expected.body
+    assert len(body) == int(expected.headers["Content-Length"])
+    assert body.content_type == expected.headers["Content-Type"]
+
+
+def test_multipart_body_can_be_iterated_twice():
+    body = _MultipartBody("file", "a.txt", b"abc", "text/plain")
+    assert b"".join(body) == b"".join(body)
+
+
+def test_upload_file_streams_multipart_body(monkeypatch):
+    sent = {}
+
+    class _Resp:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"id": "file-1"}
+
+    class _Session:
+        def post(self, url, **kwargs):
+            sent.update(kwargs, url=url)
+            return _Resp()
+
+    monkeypatch.setattr(openwebui, "_session", _Session())
+
+    url = openwebui.upload_file(
+        "http://owui", {"Authorization": "Bearer t"}, "a.pdf", b"%PDF",
+        content_type="application/pdf",
+    )
+
+    assert url == "http://owui/api/v1/files/file-1/content"
+    assert isinstance(sent["data"], _MultipartBody)
+    assert sent["headers"]["Authorization"] == "Bearer t"
+    assert sent["headers"]["Content-Type"] == sent["data"].content_type
+    assert b"%PDF" in b"".join(sent["data"])
+
+
+# ---------------------------------------------------------------------------
+# find_files_in_messages
+# ---------------------------------------------------------------------------
+
+
+def _messages():
+    """Oldest first; find_files_in_messages searches newest-first."""
+    return [
+        {"role": "user", "content": "old", "_files": [
+            {"id": "old-pdf", "name": "Old.PDF", "content_type": "application/pdf"},
+            {"id": "photo", "name": "photo.JPG", "content_type": "image/jpeg"},
+        ]},
+        {"role": "assistant", "content": "ok"},
+        {"role": "user", "content": "new", "_files": [
+            {"id": "", "name": "no-id.pdf", "content_type": "application/pdf"},
+            {"id": "notes", "name": "notes.txt", "content_type": "text/plain"},
+            {"id": "new-pdf", "name": "new.pdf", "content_type": "application/pdf"},
+        ]},
+    ]
+
+
+def _ids(files):
+    return [f["id"] for f in files]
+
+
+def test_find_files_returns_all_newest_first():
+    assert _ids(find_files_in_messages(_messages())) == [
+        "notes", "new-pdf", "old-pdf", "photo",
+    ]
+
+
+def test_find_files_by_extension_is_case_insensitive():
+    found = find_files_in_messages(_messages(), extension=".PDF")
+    assert _ids(found) == ["new-pdf", "old-pdf"]
+
+
+def test_find_files_by_extension_tuple():
+    found = find_files_in_messages(_messages(), extension=(".txt", ".jpg"))
+    assert _ids(found) == ["notes", "photo"]
+
+
+def test_find_files_by_content_type():
+    found = find_files_in_messages(_messages(), content_type="IMAGE/")
+    assert _ids(found) == ["photo"]
+
+
+def test_find_files_combines_filters():
+    found = find_files_in_messages(
+        _messages(), content_type="pdf", extension=(".pdf", ".jpg")
+    )
+    assert _ids(found) == ["new-pdf", "old-pdf"]
+
+
+def test_find_files_limit_stops_at_newest():
+    assert _ids(find_files_in_messages(_messages(), extension=".pdf", limit=1)) == ["new-pdf"]
+    assert _ids(find_files_in_messages(_messages(), limit=3)) == ["notes", "new-pdf", "old-pdf"]
+
+
+def test_find_files_leaves_messages_untouched():
+    messages = _messages()
+    find_files_in_messages(messages, extension=".pdf")
+    assert messages == _messages()
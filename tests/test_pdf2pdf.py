@@ -0,0 +1,243 @@
+"""Tests for the pdf2pdf translation batching, cache and page planning."""
+
+import sqlite3
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+import pytest
+
+# The example's own dependencies (examples/experimental/pdf2pdf/requirements.txt)
+fitz = pytest.importorskip("fitz")
+pytest.importorskip("arabic_reshaper")
+pytest.importorskip("bidi")
+
+from examples.experimental.pdf2pdf import pdf
+from examples.experimental.pdf2pdf.cache import TranslationCache
+from examples.experimental.pdf2pdf.pipeline import _parse_translations, translate_batch
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+
+_MODEL = "test/model:1b"
+_PROMPT = "Translate to Arabic."
+
+
+class _FakeResponse:
+    def __init__(self, reply):
+        self.content = orjson.dumps(
+            {"choices": [{"message": {"content": reply}}]}
+        )
+
+    def raise_for_status(self):
+        pass
+
+
+class _FakeSession:
+    """Answers every translation request with the next of *replies*."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def post(self, url, **kwargs):
+        messages = orjson.loads(kwargs["data"])["messages"]
+        self.prompts.append(messages[-1]["content"])
+        return _FakeResponse(self.replies.pop(0))
+
+
+class _BrokenCache:
+    """A cache whose database has gone away."""
+
+    key = staticmethod(TranslationCache.key)
+
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+
+    def get_many(self, keys):
+        if "get" in self.fail_on:
+            raise sqlite3.OperationalError("database is locked")
+        return {}
+
+    def put_many(self, items):
+        if "put" in self.fail_on:
+            raise sqlite3.OperationalError("disk I/O error")
+
+
+def _translate(session, texts, cache=None):
+    return translate_batch(
+        session, texts, "http://localhost:8080", {}, _MODEL, _PROMPT, cache=cache
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = TranslationCache(str(tmp_path / "cache.sqlite"))
+    yield c
+    c.close()
+
+
+# ---------------------------------------------------------------------------
+# Reply parsing
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("sep", [".", ")", "-", ":"])
+def test_parse_numbered_reply(sep):
+    reply = f"1{sep} واحد\n\n2{sep} اثنان\n"
+    assert _parse_translations(reply, ["one", "two"]) == (["واحد", "اثنان"], True)
+
+
+def test_parse_matches_by_number_not_position():
+    reply = "2. اثنان\n1. واحد"
+    assert _parse_translations(reply, ["one", "two"]) == (["واحد", "اثنان"], True)
+
+
+def test_parse_single_unnumbered_line():
+    assert _parse_translations("  واحد  ", ["one"]) == (["واحد"], True)
+
+
+def test_parse_unnumbered_lines_pair_by_position():
+    translations, complete = _parse_translations("واحد\nاثنان", ["one", "two"])
+    assert translations == ["واحد", "اثنان"]
+    assert not complete
+
+
+def test_parse_missing_item_keeps_original(caplog):
+    translations, complete = _parse_translations("1. واحد", ["one", "two"])
+    assert translations == ["واحد", "two"]
+    assert not complete
+    assert "1 of 2 texts untranslated" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [
+        "1. واحد\n2. اثنان\nو",  # split item
+        "1. واحد\n2. اثنان\n3. ثلاثة",  # out of range
+        "1. واحد\n1. أيضا\n2. اثنان",  # repeated
+    ],
+)
+def test_parse_stray_lines_are_incomplete(reply):
+    translations, complete = _parse_translations(reply, ["one", "two"])
+    assert translations == ["واحد", "اثنان"]
+    assert not complete
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+
+def test_translate_batch_without_cache():
+    session = _FakeSession("1. واحد\n2. اثنان")
+    assert _translate(session, ["one", "two"]) == ["واحد", "اثنان"]
+
+
+def test_translate_batch_only_requests_misses(cache):
+    cache.put_many([(cache.key(_MODEL, _PROMPT, "one"), "واحد")])
+    session = _FakeSession("1. اثنان")
+
+    assert _translate(session, ["one", "two"], cache) == ["واحد", "اثنان"]
+    assert len(session.prompts) == 1
+    assert "1. two" in session.prompts[0]
+    assert "one" not in session.prompts[0]
+
+
+def test_translate_batch_stores_complete_replies(cache):
+    _translate(_FakeSession("1. واحد\n2. اثنان"), ["one", "two"], cache)
+
+    session = _FakeSession()
+    assert _translate(session, ["two", "one"], cache) == ["اثنان", "واحد"]
+    assert session.prompts == []
+
+
+def test_translate_batch_skips_storing_incomplete_replies(cache):
+    _translate(_FakeSession("1. واحد"), ["one", "two"], cache)
+
+    keys = [cache.key(_MODEL, _PROMPT, t) for t in ("one", "two")]
+    assert cache.get_many(keys) == {}
+
+
+def test_translate_batch_survives_cache_read_error(caplog):
+    cache = _BrokenCache(fail_on={"get"})
+    session = _FakeSession("1. واحد")
+
+    assert _translate(session, ["one"], cache) == ["واحد"]
+    assert "cache read failed" in caplog.text
+
+
+def test_translate_batch_survives_cache_write_error(caplog):
+    cache = _BrokenCache(fail_on={"put"})
+    session = _FakeSession("1. واحد")
+
+    assert _translate(session, ["one"], cache) == ["واحد"]
+    assert "cache write failed" in caplog.text
+
+
+# ---------------------------------------------------------------------------
+# Page planning
+# ---------------------------------------------------------------------------
+
+
+class _BrokenPool:
+    """A process pool whose workers have died."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def map(self, fn, *iterables):
+        raise BrokenProcessPool("a worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_plan_pdf_replans_inline_when_pool_breaks(monkeypatch):
+    broken = _BrokenPool()
+    monkeypatch.setattr(pdf, "_pool", broken)
+    monkeypatch.setattr(pdf, "_plan_page", lambda path, page, width: page["n"])
+    layout = {
+        "pdf_width": 612,
+        "pages": [{"n": i} for i in range(pdf.PARALLEL_MIN_PAGES)],
+    }
+
+    assert pdf.plan_pdf("doc.pdf", layout) == list(range(pdf.PARALLEL_MIN_PAGES))
+    assert broken.shut_down
+    assert pdf._pool is None
+
+
+# ---------------------------------------------------------------------------
+# Text fitting
+# ---------------------------------------------------------------------------
+
+
+class _FlatFont:
+    """A font reporting no line height, as some broken embedded fonts do."""
+
+    ascender = descender = 0.0
+
+    def text_length(self, text, fontsize):
+        return len(text) * fontsize
+
+
+def test_insert_fitted_skips_zero_font_size(caplog):
+    page = fitz.open().new_page()
+    font = fitz.Font("helv")
+
+    pdf._insert_fitted(page, fitz.Rect(10, 10, 200, 40), "hello", font, "helv", 0, (0, 0, 0))
+
+    assert page.get_text() == ""
+    assert "font size 0" in caplog.text
+
+
+def test_insert_fitted_without_line_height_skips_estimate():
+    page = fitz.open().new_page()
+
+    pdf._insert_fitted(
+        page, fitz.Rect(10, 10, 200, 40), "hello", _FlatFont(), "helv", 11, (0, 0, 0)
+    )
+
+    assert "hello" in page.get_text()
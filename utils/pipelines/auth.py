@@ -63,7 +63,9 @@ def extract_token_from_auth_header(auth_header: str):
     return auth_header[len("Bearer ") :]
 
 
-def get_current_user(
+# async on purpose: FastAPI runs plain-def dependencies in its threadpool,
+# which would cost a thread hop per request for a string comparison
+async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(bearer_security),
 ) -> Optional[dict]:
     token = credentials.credentials
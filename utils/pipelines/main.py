@@ -48,6 +48,9 @@ def get_last_assistant_message(messages: List[dict]) -> str:
 
 
 def get_system_message(messages: List[dict]) -> dict:
+    # Open WebUI puts the system message first; only scan when it doesn't
+    if messages and messages[0]["role"] == "system":
+        return messages[0]
     for message in messages:
         if message["role"] == "system":
             return message
@@ -59,7 +62,14 @@ def remove_system_message(messages: List[dict]) -> List[dict]:
 
 
 def pop_system_message(messages: List[dict]) -> Tuple[dict, List[dict]]:
-    return get_system_message(messages), remove_system_message(messages)
+    system, rest = None, []
+    for message in messages:
+        if message["role"] == "system":
+            if system is None:
+                system = message
+        else:
+            rest.append(message)
+    return system, rest
 
 
 def add_or_update_system_message(content: str, messages: List[dict]) -> List[dict]:
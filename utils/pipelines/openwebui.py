@@ -9,12 +9,51 @@ Provides utilities for pipelines that call back to Open WebUI via the
 """
 
 import logging
-from typing import List, Optional
+from typing import List, Optional, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+from urllib3.util.retry import Retry
 
 log = logging.getLogger(__name__)
 
+# (connect, read) seconds: fail fast on an unreachable Open WebUI instead of
+# hanging the pipeline thread
+TIMEOUT = (3.05, 30)
+
+# Open WebUI may process an uploaded file (extraction, embedding) before it
+# replies, and a timed-out POST is not retried: give uploads a long read
+UPLOAD_TIMEOUT = (3.05, 300)
+
+# What a failed Open WebUI call raises in the sync helpers: transport and
+# HTTP errors, or a reply that isn't the expected JSON.  Anything else is a
+# bug and propagates.
+_REQUEST_ERRORS = (requests.RequestException, ValueError, KeyError, TypeError)
+
+
+def _new_session() -> requests.Session:
+    """Keep-alive session shared by the file helpers.
+
+    Idempotent requests (GET) are retried on transient gateway errors;
+    urllib3 never retries POST by default, so uploads are not duplicated.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504)
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_session = _new_session()
+
 
 # ---------------------------------------------------------------------------
 # Status events
@@ -72,16 +111,45 @@ def download_file(
 ) -> Optional[bytes]:
     """Download file content by *file_id* from Open WebUI."""
     try:
-        r = requests.get(
-            f"{base_url}/api/v1/files/{file_id}/content", headers=headers
+        r = _session.get(
+            f"{base_url}/api/v1/files/{file_id}/content",
+            headers=headers,
+            timeout=TIMEOUT,
         )
         r.raise_for_status()
         return r.content
-    except Exception as e:
-        log.error(f"Failed to download file {file_id}: {e}")
+    except _REQUEST_ERRORS as e:
+        log.error("Failed to download file %s: %s", file_id, e)
         return None
 
 
+class _MultipartBody:
+    """Single-file ``multipart/form-data`` body that streams *content*.
+
+    ``files=`` makes requests copy the whole payload into one encoded body;
+    this yields the part headers, the original bytes and the closing
+    boundary instead.  ``__len__`` lets requests send a Content-Length
+    rather than falling back to chunked transfer encoding.
+    """
+
+    def __init__(self, field: str, filename: str, content: bytes, content_type: str):
+        boundary = choose_boundary()
+        part = RequestField(name=field, data=b"", filename=filename)
+        part.make_multipart(content_type=content_type)
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._head = f"--{boundary}\r\n{part.render_headers()}".encode()
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._content = content
+
+    def __len__(self) -> int:
+        return len(self._head) + len(self._content) + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        yield self._content
+        yield self._tail
+
+
 def upload_file(
     base_url: str,
     headers: dict,
@@ -91,16 +159,18 @@ def upload_file(
 ) -> Optional[str]:
     """Upload a file to Open WebUI and return its content URL."""
     try:
-        r = requests.post(
+        body = _MultipartBody("file", filename, content, content_type)
+        r = _session.post(
             f"{base_url}/api/v1/files/",
-            headers=headers,
-            files={"file": (filename, content, content_type)},
+            headers={**headers, "Content-Type": body.content_type},
+            data=body,
+            timeout=UPLOAD_TIMEOUT,
         )
         r.raise_for_status()
         file_id = r.json()["id"]
         return f"{base_url}/api/v1/files/{file_id}/content"
-    except Exception as e:
-        log.error(f"Failed to upload file: {e}")
+    except _REQUEST_ERRORS as e:
+        log.error("Failed to upload file %s: %s", filename, e)
         return None
 
 
@@ -109,11 +179,26 @@ def upload_file(
 # ---------------------------------------------------------------------------
 
 
+def _build_matcher(ext: Optional[tuple[str, ...]], ct: Optional[str]):
+    """Return a predicate over ``_files`` entries for the lower-cased filters."""
+    if ext and ct:
+        return lambda f: (
+            f.get("name", "").lower().endswith(ext)
+            and ct in f.get("content_type", "").lower()
+        )
+    if ext:
+        return lambda f: f.get("name", "").lower().endswith(ext)
+    if ct:
+        return lambda f: ct in f.get("content_type", "").lower()
+    return None
+
+
 def find_files_in_messages(
     messages: List[dict],
     *,
     content_type: Optional[str] = None,
-    extension: Optional[str] = None,
+    extension: Union[str, tuple[str, ...], None] = None,
+    limit: Optional[int] = None,
 ) -> list[dict]:
     """Return all ``_files`` entries from *messages* matching the filter.
 
@@ -121,21 +206,30 @@ def find_files_in_messages(
     ``id``, ``name``, and ``content_type``.
 
     Pass *content_type* (substring match, case-insensitive) and/or
-    *extension* (e.g. ``".pdf"``, case-insensitive) to filter.
+    *extension* (e.g. ``".pdf"`` or ``(".png", ".jpg")``, case-insensitive)
+    to filter, and *limit* to stop once that many files were found.
     """
-    ext = extension.lower() if extension else None
-    ct = content_type.lower() if content_type else None
+    # str.endswith takes a tuple, so several extensions cost one scan
+    if isinstance(extension, str):
+        ext = (extension.lower(),)
+    elif extension:
+        ext = tuple(e.lower() for e in extension)
+    else:
+        ext = None
+
+    match = _build_matcher(ext, content_type.lower() if content_type else None)
 
     results: list[dict] = []
     for msg in reversed(messages):
-        for f in msg.get("_files", []):
+        files = msg.get("_files")
+        if not files:
+            continue
+        for f in files:
             if not f.get("id"):
                 continue
-            name = f.get("name", "")
-            fct = f.get("content_type", "")
-            if ext and not name.lower().endswith(ext):
-                continue
-            if ct and ct not in fct.lower():
+            if match is not None and not match(f):
                 continue
             results.append(f)
+            if limit and len(results) >= limit:
+                return results
     return results